@@ -1,14 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, jsonify, stream_with_context
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, jsonify, stream_with_context, current_app
 from config import Config
 from extensions import db  # Import db from the new file
 from werkzeug.security import generate_password_hash, check_password_hash
-import ollama
-import chromadb
-from chromadb.utils import embedding_functions
-from rag_utils import init_chromadb, query_context, process_uploaded_file
+from rag_utils import (
+    retrieve, format_context, process_uploaded_file, embed_query, estimate_tokens,
+    text_hash, on_document_changed, clean_filters, detect_filters, start_background_init, use_rag_service, rag_status,
+    rag_available
+)
+from jobs import JobQueue
+from upload_store import UploadStore
+from scheduler import LLMScheduler, format_queue_status
+from response_cache import ResponseCache
+from metrics import registry, span, start_trace, finish_trace, GenerationTimer, verbose
 import os
 from werkzeug.utils import secure_filename
-import datetime
+import shutil
+import uuid
 
 
 
@@ -17,7 +24,9 @@ app.config.from_object(Config)
 db.init_app(app)
 
 # Import models AFTER db is initialized
-from models import User, ChatSession, Message
+from models import User, ChatSession, Message, Attachment, delete_unreferenced_attachments, upgrade_schema
+from history import build_history, schedule_summary_update
+from prompts import chat_messages, is_standalone, model_options
 
 
 
@@ -86,8 +95,8 @@ def index():
 @app.route('/chat')
 @login_required
 def chat():
-    # Load user sessions for sidebar
-    user_sessions = ChatSession.query.filter_by(user_id=session["user_id"]).all()
+    # Load user sessions for sidebar, only the columns it shows
+    user_sessions = db.session.query(ChatSession.id, ChatSession.name).filter_by(user_id=session["user_id"]).order_by(ChatSession.id).all()
     if not user_sessions:
         # Create a default session if none exists
         default_session = ChatSession(name="Default Chat", user_id=session["user_id"])
@@ -121,103 +130,363 @@ def rename_session(session_id):
 def delete_session(session_id):
     chat_session = ChatSession.query.filter_by(id=session_id, user_id=session["user_id"]).first()
     if chat_session:
+        attachment_keys = {msg.attachment_key for msg in chat_session.messages if msg.attachment_key}
         db.session.delete(chat_session)
+        db.session.flush()
+        # Documents attached in this session and nowhere else
+        if attachment_keys:
+            delete_unreferenced_attachments(attachment_keys)
         db.session.commit()
     return redirect(url_for('chat'))
 
 @app.route('/chat_history/<int:session_id>')
 @login_required
 def chat_history(session_id):
+    """
+    Return one page of a session's messages, oldest first.
+    ?limit=N caps the page size, ?before_id=M returns the messages before message M.
+    """
     chat_session = ChatSession.query.filter_by(id=session_id, user_id=session["user_id"]).first_or_404()
-    messages = Message.query.filter_by(session_id=chat_session.id).order_by(Message.timestamp.asc()).all()
-    history = [{"is_user": msg.is_user, "content": msg.content, "timestamp": msg.timestamp.isoformat()} for msg in messages]
-    return jsonify(history)
+    limit = min(request.args.get("limit", 50, type=int), 200)
+    before_id = request.args.get("before_id", type=int)
+
+    query = Message.query.filter(Message.session_id == chat_session.id)
+    if before_id is not None:
+        anchor = Message.query.filter_by(id=before_id, session_id=chat_session.id).first_or_404()
+        query = query.filter(db.or_(
+            Message.timestamp < anchor.timestamp,
+            db.and_(Message.timestamp == anchor.timestamp, Message.id < anchor.id)
+        ))
+    # Newest first to take the page from the end, one extra row tells whether more exist
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    has_more = len(messages) > limit
+    messages = messages[:limit][::-1]
+
+    history = [{"id": msg.id, "is_user": msg.is_user, "content": msg.content, "timestamp": msg.timestamp.isoformat()} for msg in messages]
+    return jsonify({
+        "messages": history,
+        "has_more": has_more,
+        "next_before_id": messages[0].id if has_more else None
+    })
 
 # Chat message sending and streaming response
 
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
+CHAT_MODEL = 'gemma3:27b'
+# Every generation goes through the scheduler: bounded concurrency, fair queueing per user
+llm_scheduler = LLMScheduler(
+    max_concurrent=app.config['LLM_MAX_CONCURRENT'],
+    background_max_wait=app.config['LLM_BACKGROUND_MAX_WAIT']
+)
+
+# Opt-in semantic cache of finished answers, dropped per document when it is re-indexed
+response_cache = None
+if app.config['RESPONSE_CACHE_ENABLED']:
+    response_cache = ResponseCache(
+        max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+        ttl_seconds=app.config['RESPONSE_CACHE_TTL'],
+        similarity_threshold=app.config['RESPONSE_CACHE_SIMILARITY']
+    )
+    on_document_changed(response_cache.invalidate_path)
+
+def is_cacheable(user_message, messages, passages):
+    # Only first questions answered from documents are shared between users: a follow-up
+    # ("explain that in more detail") means something else in every conversation.
+    # Long messages usually carry an attached document, answers to those are not reused
+    return (
+        response_cache is not None
+        and rag_available.is_set()
+        and bool(passages)
+        and is_standalone(messages)
+        and estimate_tokens(user_message) <= app.config['RESPONSE_CACHE_MAX_QUERY_TOKENS']
+    )
 
-
-
-def stream_and_save_response(user_message, chat_session):
-    complete_response = ""
+def cached_response(user_message, messages, passages):
+    """Return a stored answer to a near-identical question over the same passages, or None."""
+    if not is_cacheable(user_message, messages, passages):
+        return None
+    try:
+        return response_cache.lookup(embed_query(user_message), [passage["id"] for passage in passages])
+    except (OSError, RuntimeError) as e:
+        print(f"Response cache lookup failed: {e}")
+        return None
+
+def remember_response(user_message, messages, passages, response):
+    if not is_cacheable(user_message, messages, passages):
+        return
     try:
-        # Retrieve the conversation history, excluding the latest user message
-        messages = Message.query.filter_by(session_id=chat_session.id).order_by(Message.timestamp.asc()).all()
-        conversation_history = "\n".join(
-            [f"{'User' if msg.is_user else 'Bot'}: {msg.content}" for msg in messages[:-1]]  # Exclude the last message
+        response_cache.store(
+            embed_query(user_message),
+            [passage["id"] for passage in passages],
+            [passage["path"] for passage in passages],
+            response
         )
+    except (OSError, RuntimeError) as e:
+        print(f"Failed to cache response: {e}")
 
-        # Retrieve context from ChromaDB with a stricter similarity threshold
-        context = query_context(user_message, n_results=5, similarity_threshold=1.5)
 
-        # Combine the context, conversation history, and user's message
-        if context:
-            prompt = f"role: you are the official KZU-AI, the AI tutor/assistant of the kantonsschule zürcher unterland, Your job is to help students/users in any way they needy you have an RAG built into you that will supply you with data relevant to the context, it features old tests, presentations, homework, school assignments etc. its sorted by subject and professor, use it to help students prepare for their exams or anything else. Your only responsibility is to help students, nothing else, you will do their homework, fill out their assignemtns etc. whenever they demand. language: whatever language user talks to you in, dont speak any other language or translate to english automatically, only when asked. Context from RAG:\n{context}\n\nConversation History:\n{conversation_history}\n\nUser: {user_message}"
-        else:
-            prompt = f"role: you are the official KZU-AI, the AI tutor/assistant of the kantonsschule zürcher unterland, Your job is to help students/users in any way they needy you have an RAG built into you that will supply you with data relevant to the context, it features old tests, presentations, homework, school assignments etc. its sorted by subject and professor, use it to help students prepare for their exams or anything else. Your only responsibility is to help students, nothing else, you will do their homework, fill out their assignemtns etc. whenever they demand. language: whatever language user talks to you in, dont speak any other language or translate to english automatically, only when asked. Conversation History:\n{conversation_history}\n\nUser: {user_message}"
 
-        # Call the Ollama chat function with the combined prompt
-        print(f"Prompt sent to model: {prompt}")  # Debug statement
-        stream = ollama.chat('gemma3:27b', [{'role': 'user', 'content': prompt}], stream=True)
+def build_prompt(user_message, chat_session_id, user_message_id=None, filters=None):
+    """
+    Assemble the chat messages for the model: system prompt, session summary, the bounded
+    history and the user's message with its RAG context, see prompts.py for the order.
+    filters narrow the RAG search to a subject, teacher or document type.
+    Returns (messages, retrieved passages).
+    """
+    chat_session = db.session.get(ChatSession, chat_session_id)
+
+    # Retrieve the bounded conversation history, excluding the latest user message
+    with span("history_load"):
+        summary, history = build_history(chat_session, before_id=user_message_id)
+
+    # Retrieve context from ChromaDB with a stricter similarity threshold
+    if not rag_available.is_set():
+        # Still warming up (or failed), answer without documents
+        print(f"RAG not available ({rag_status()['state']}), answering without context")
+        passages = []
+    else:
+        try:
+            with span("retrieval"):
+                passages = retrieve(user_message, n_results=5, similarity_threshold=1.5, filters=filters)
+                if not passages and filters:
+                    # Nothing in the selected subset, fall back to the whole collection
+                    passages = retrieve(user_message, n_results=5, similarity_threshold=1.5)
+        except (OSError, RuntimeError) as e:
+            # E.g. the RAG service is restarting, answer without documents
+            print(f"Retrieval failed, answering without context: {e}")
+            passages = []
+
+    messages = chat_messages(summary, history, user_message, format_context(passages))
+    if verbose():
+        print(f"Prompt sent to model: {messages}")  # Debug statement
+    return messages, passages
+
+def save_bot_reply(chat_session_id, content):
+    """Store the bot's answer and let the summary catch up in the background."""
+    bot_msg = Message(session_id=chat_session_id, is_user=False, content=content)
+    db.session.add(bot_msg)
+    db.session.commit()
+    # Fold turns that fell out of the history window into the session summary
+    schedule_summary_update(current_app._get_current_object(), chat_session_id, llm_scheduler)
+
+class ChatReply:
+    """
+    One answer to a chat message: prompt, cache, generation slot, streamed text and saving.
+    Shared by stream_and_save_response() and asgi.py, which only differ in how they wait and
+    send; the methods block (database, embeddings), asgi.py runs them on worker threads.
+    """
+
+    def __init__(self, user_message, chat_session_id, user_message_id=None, filters=None, user_id=None):
+        self.user_message = user_message
+        self.chat_session_id = chat_session_id
+        self.user_message_id = user_message_id
+        self.filters = filters
+        self.user_id = user_id
+        self.messages = None
+        self.passages = None
+        self.complete_response = ""
+        self.ticket = None
+        self.last_position = None
+        self.timer = None
+        self.trace = start_trace(chat_session_id)
+
+    def prepare(self):
+        """Build the prompt; returns a cached answer to a repeated question, or None."""
+        with span("prompt_build"):
+            self.messages, self.passages = build_prompt(
+                self.user_message, self.chat_session_id, self.user_message_id, self.filters
+            )
+        # Answer repeated questions from the cache without touching the model
+        self.complete_response = cached_response(self.user_message, self.messages, self.passages) or ""
+        if self.complete_response:
+            self.trace.fields["cache_hit"] = True
+            return self.complete_response
+        return None
+
+    def submit(self):
+        """Queue for a generation slot, returns the scheduler ticket."""
+        self.ticket = llm_scheduler.submit(self.user_id, self.chat_session_id)
+        return self.ticket
+
+    def queue_status(self):
+        """Status line with the current queue position, None if it did not change since the last one."""
+        position = llm_scheduler.position(self.ticket)
+        if position == self.last_position:
+            return None
+        self.last_position = position
+        return format_queue_status(position)
+
+    def start_generation(self):
+        """Call right before the model; False if a newer message in this session replaced this request."""
+        if self.ticket.cancelled.is_set():
+            return False
+        self.timer = GenerationTimer()
+        return True
+
+    def add_chunk(self, chunk):
+        """Record a streamed chunk and return its text, None once the request was replaced."""
+        if self.ticket.cancelled.is_set():
+            # A newer message in this session replaced this request
+            return None
+        self.timer.chunk(chunk)
+        text_chunk = chunk['message']['content']
+        self.complete_response += text_chunk
+        return text_chunk
+
+    def finish_generation(self):
+        """Record the generation and cache the complete answer."""
+        self.timer.finish()
+        if not self.ticket.cancelled.is_set():
+            remember_response(self.user_message, self.messages, self.passages, self.complete_response)
+        if self.trace.verbose:
+            print(f"Final Complete Response: {self.complete_response}")  # Debug statement
+
+    def fail(self, error):
+        """The error text sent to the client, stored in place of the answer."""
+        self.complete_response = f"Error: {error}"
+        return self.complete_response
+
+    def disconnected(self):
+        print(f"Client disconnected from session {self.chat_session_id}, generation stopped")
+
+    def close(self):
+        """
+        Give the slot back and save the complete (or partial) answer. Close the model stream
+        first: dropping the connection to Ollama is what aborts the generation.
+        """
+        if self.ticket is not None:
+            llm_scheduler.release(self.ticket)
+        if self.complete_response:
+            with span("db_save"):
+                save_bot_reply(self.chat_session_id, self.complete_response)
+        finish_trace(self.trace)
+
+def stream_and_save_response(user_message, chat_session_id, user_message_id=None, filters=None, user_id=None):
+    reply = ChatReply(user_message, chat_session_id, user_message_id, filters, user_id)
+    stream = None
+    try:
+        cached = reply.prepare()
+        if cached:
+            yield cached
+            yield "\n"
+            return
+
+        # Wait for a generation slot, telling the client where it stands in the queue
+        ticket = reply.submit()
+        with span("queue_wait"):
+            while not ticket.wait(timeout=app.config['QUEUE_STATUS_INTERVAL']):
+                status = reply.queue_status()
+                if status:
+                    yield status
+        if not reply.start_generation():
+            return
+
+        # Call the Ollama chat function with the assembled messages
+        import ollama
+        stream = ollama.chat(CHAT_MODEL, reply.messages, stream=True, **model_options())
         for chunk in stream:
-            
-            text_chunk = chunk['message']['content']
-            complete_response += text_chunk  # Append the chunk to the complete response
+            text_chunk = reply.add_chunk(chunk)
+            if text_chunk is None:
+                break
             yield text_chunk  # Yield each chunk as it's received.
         yield "\n"  # Optionally yield a new line.
-
-        # Log the final complete response
-        print(f"Final Complete Response: {complete_response}")  # Debug statement
+        reply.finish_generation()
+    except GeneratorExit:
+        # The client went away, the finally block stops the generation
+        reply.disconnected()
+        raise
     except Exception as e:
-        error_msg = f"Error: {e}"
-        yield error_msg
-        complete_response = error_msg
-    # Save the complete response to the DB.
-    bot_msg = Message(session_id=chat_session.id, is_user=False, content=complete_response)
-    db.session.add(bot_msg)
-    db.session.commit()
-
-@app.route('/send_message', methods=['POST'])
-@login_required
-def send_message():
-    data = request.get_json()
+        yield reply.fail(e)
+    finally:
+        if stream is not None:
+            stream.close()
+        reply.close()
+
+def start_chat_turn(user_id, data):
+    """
+    Validate a /send_message payload and store the user's message.
+    The optional "filters" ({"subject", "teacher", "doc_type"}) restrict the RAG search, without
+    them the subject is guessed from the session's name.
+    Returns ((full_message, chat_session_id, user_message_id, filters), None) or (None, (error, status)).
+    """
     user_message = data.get("message")
     session_id = data.get("session_id")
 
     # Make sure the chat session exists
-    chat_session = ChatSession.query.filter_by(id=session_id, user_id=session["user_id"]).first()
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first()
     if not chat_session:
-        return jsonify({"error": "Chat session not found"}), 404
-
-    # Check for temporary uploaded content
-    uploaded_content = temp_uploads.pop(session_id, None)
-    if uploaded_content:
-        # Combine user message with uploaded content
-        full_message = f"{user_message}\n\n📄 Attached document: {uploaded_content['filename']}\n\nContent:\n{uploaded_content['extracted_text']}"
-    else:
-        full_message = user_message
-
-    # Save the user's message
-    user_msg = Message(session_id=chat_session.id, is_user=True, content=full_message)
+        return None, ("Chat session not found", 404)
+
+    filters = clean_filters(data.get("filters")) or detect_filters(chat_session.name)
+
+    # Save the user's message, with a document uploaded to this session since the last one
+    user_msg = Message(session_id=chat_session.id, is_user=True, content=user_message)
+    pending_upload = upload_store.take(chat_session.id, user_id)
+    if pending_upload:
+        filename, extracted_text = pending_upload
+        user_msg.content = f"{user_message}\n\n📄 Attached document: {filename}"
+        # Keyed by content, the same document attached again shares one row
+        key = text_hash(extracted_text)
+        user_msg.attachment = db.session.get(Attachment, key) or Attachment(key=key, filename=filename, content=extracted_text)
     db.session.add(user_msg)
     db.session.commit()
+    return (user_msg.full_content, chat_session.id, user_msg.id, filters), None
+
+@app.route('/send_message', methods=['POST'])
+@login_required
+def send_message():
+    turn, error = start_chat_turn(session["user_id"], request.get_json())
+    if error:
+        message, status = error
+        return jsonify({"error": message}), status
 
     # Stream the response
     return Response(
-        stream_with_context(stream_and_save_response(full_message, chat_session)),
+        stream_with_context(stream_and_save_response(*turn, user_id=session["user_id"])),
         mimetype='text/plain'
     )
 
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'tiff', 'bmp'}
-# Dictionary to store temporary upload content
-temp_uploads = {}
+# Extracted text waiting for the session's next message, and upload job status
+upload_store = UploadStore(
+    app.config['UPLOAD_STORE_PATH'],
+    max_bytes=app.config['UPLOAD_STORE_MAX_BYTES'],
+    ttl_seconds=app.config['UPLOAD_STORE_TTL']
+)
+# Background workers doing OCR and indexing, so uploads don't block request handling
+upload_jobs = JobQueue(max_workers=app.config['UPLOAD_WORKERS'], store=upload_store)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def run_upload_job(temp_path, session_id, owner, progress):
+    """Extract and index an uploaded file, then attach it to the session's next message."""
+    filename = os.path.basename(temp_path)
+    try:
+        # Uploads are indexed, so they have to wait for the knowledge base to load
+        progress(0.0, "Waiting for the knowledge base")
+        while not rag_available.wait(timeout=1):
+            if rag_status()["state"] == "failed":
+                raise RuntimeError("The knowledge base is unavailable")
+        extracted_text, final_path = process_uploaded_file(
+            temp_path,
+            destination_dir="RAG_SCANNABLE_DOCUMENTS",
+            progress_callback=progress
+        )
+    finally:
+        # Clean up temporary file
+        shutil.rmtree(os.path.dirname(temp_path), ignore_errors=True)
+
+    # Attach to the session's next message
+    upload_store.put(session_id, owner, filename, extracted_text)
+    return {
+        'filename': filename,
+        'stored_path': final_path,
+        'added_to_rag': True
+    }
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -229,60 +498,84 @@ def upload_file():
     
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=session["user_id"]).first()
+    if not chat_session:
+        return jsonify({'error': 'Chat session not found'}), 404
         
     if file and allowed_file(file.filename):
         try:
-            # Create temporary upload directory if it doesn't exist
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            
-            # Save uploaded file temporarily
+            # Save uploaded file into its own temporary directory so concurrent uploads can't collide
             filename = secure_filename(file.filename)
-            temp_path = os.path.join(UPLOAD_FOLDER, filename)
+            temp_dir = os.path.join(UPLOAD_FOLDER, uuid.uuid4().hex)
+            os.makedirs(temp_dir, exist_ok=True)
+            temp_path = os.path.join(temp_dir, filename)
             file.save(temp_path)
             
-            # Process the file and add to RAG system
-            extracted_text, final_path = process_uploaded_file(
-                temp_path, 
-                destination_dir="RAG_SCANNABLE_DOCUMENTS"
-            )
-            
-            # Store in temporary uploads
-            temp_uploads[session_id] = {
-                'filename': filename,
-                'extracted_text': extracted_text,
-                'timestamp': datetime.datetime.now()
-            }
-            
-            # Clean up temporary file
-            os.remove(temp_path)
-            
+            # Process the file and add it to the RAG system in the background
+            job_id = upload_jobs.submit(run_upload_job, temp_path, chat_session.id, session["user_id"], owner=session["user_id"])
             return jsonify({
-                'message': 'File processed successfully',
-                'extracted_text': extracted_text,
-                'stored_path': final_path,
-                'added_to_rag': True
-            })
+                'message': 'File queued for processing',
+                'job_id': job_id,
+                'status_url': url_for('upload_status', job_id=job_id)
+            }), 202
             
         except Exception as e:
             return jsonify({'error': str(e)}), 500
             
     return jsonify({'error': 'Invalid file type'}), 400
 
-def cleanup_temp_uploads():
-    """Clean up temporary uploads older than 1 hour"""
-    current_time = datetime.datetime.now()
-    expired_sessions = [
-        session_id for session_id, data in temp_uploads.items()
-        if (current_time - data['timestamp']).total_seconds() > 3600
-    ]
-    for session_id in expired_sessions:
-        temp_uploads.pop(session_id, None)
-
-# Run the application
-
-if __name__ == '__main__':
+@app.route('/upload_status/<job_id>')
+@login_required
+def upload_status(job_id):
+    job = upload_jobs.get(job_id)
+    if not job or job['owner'] != session["user_id"]:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'state': job['state'],
+        'progress': job['progress'],
+        'message': job['message'],
+        'result': job['result'],
+        'error': job['error']
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Chat pipeline latency histograms and queue gauges in the Prometheus text format (this process only)."""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+registry.gauge("kzu_llm_active_generations", "Generations running on the model", lambda: llm_scheduler.stats()["active"])
+registry.gauge("kzu_llm_queued_requests", "Requests waiting for a generation slot", lambda: llm_scheduler.stats()["queued"])
+registry.gauge("kzu_llm_queued_summaries", "Summary updates waiting for an idle generation slot", lambda: llm_scheduler.stats()["background"])
+
+@app.route('/ready')
+def ready():
+    """Readiness of the RAG system; the rest of the app is served while it warms up."""
+    status = rag_status()
+    return jsonify(status), 200 if status["available"] else 503
+
+def setup():
+    """
+    Prepare the database and start loading the RAG index, run once before serving requests.
+    The embedding model and the index load in the background, see /ready.
+    """
     # Create DB tables if they don't exist yet.
     with app.app_context():
         db.create_all()
-    init_chromadb("RAG_scannable_documents")  # Pass only the documents directory.
+        upgrade_schema()
+        # Left behind by sessions deleted before attachments were cleaned up with them
+        if delete_unreferenced_attachments():
+            db.session.commit()
+    if app.config['RAG_SERVICE_ADDRESS']:
+        # Model and index live in the shared rag_service.py process
+        use_rag_service(app.config['RAG_SERVICE_ADDRESS'])
+    else:
+        start_background_init("RAG_scannable_documents")  # Pass only the documents directory.
+
+# Run the application (development server, see asgi.py for production serving)
+
+if __name__ == '__main__':
+    # The debug reloader runs this file twice, only its serving child loads the index
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        setup()
     app.run(debug=True)
@@ -0,0 +1,169 @@
+"""
+Production entry point: serves the Flask app over ASGI and streams chat answers natively.
+
+/send_message is handled by an asyncio coroutine using Ollama's async client, so an
+open token stream costs a coroutine instead of a blocked worker thread. Every other
+route goes through the regular Flask app.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+or
+    python asgi.py
+"""
+import asyncio
+import json
+from a2wsgi import WSGIMiddleware
+from werkzeug.wrappers import Request
+from app import app, setup, start_chat_turn, ChatReply, CHAT_MODEL
+from prompts import model_options
+from metrics import span
+
+# Regular Flask routes run on a bounded thread pool
+flask_application = WSGIMiddleware(app, workers=app.config['WSGI_THREADS'])
+
+async def run_in_app(fn, *args):
+    """Run blocking app code (DB, retrieval) on a worker thread inside an app context."""
+    def call():
+        with app.app_context():
+            return fn(*args)
+    return await asyncio.to_thread(call)
+
+def load_user_id(scope):
+    """Read the logged in user from Flask's signed session cookie."""
+    cookies = "; ".join(
+        value.decode("latin-1") for name, value in scope["headers"] if name == b"cookie"
+    )
+    request = Request({"HTTP_COOKIE": cookies})
+    flask_session = app.session_interface.open_session(app, request)
+    return flask_session.get("user_id") if flask_session else None
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def send_json(send, payload, status):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode()})
+
+async def send_text(send, text):
+    # Waits while the client's socket buffer is full, so slow readers slow down generation
+    await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+async def stream_reply(send, user_message, chat_session_id, user_message_id, filters, user_id):
+    """Stream the model's answer to the client and store it, partial if the stream was cut."""
+    # Worker threads started by run_in_app copy the context, so their spans land in this trace
+    reply = ChatReply(user_message, chat_session_id, user_message_id, filters, user_id)
+    stream = None
+    try:
+        cached = await run_in_app(reply.prepare)
+        if cached:
+            await send_text(send, cached + "\n")
+            return
+
+        # Wait for a generation slot, telling the client where it stands in the queue
+        ticket = reply.submit()
+        with span("queue_wait"):
+            # The scheduler wakes the coroutine on grant, in between the position is sent once per interval
+            while not await ticket.wait_async(app.config['QUEUE_STATUS_INTERVAL']):
+                status = reply.queue_status()
+                if status:
+                    await send_text(send, status)
+        if not reply.start_generation():
+            return
+
+        import ollama
+        stream = await ollama.AsyncClient().chat(CHAT_MODEL, reply.messages, stream=True, **model_options())
+        async for chunk in stream:
+            text_chunk = reply.add_chunk(chunk)
+            if text_chunk is None:
+                break
+            await send_text(send, text_chunk)
+        await send_text(send, "\n")
+        await asyncio.to_thread(reply.finish_generation)
+    except asyncio.CancelledError:
+        reply.disconnected()
+        raise
+    except Exception as e:
+        await send_text(send, reply.fail(e))
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        await run_in_app(reply.close)
+
+async def send_message(scope, receive, send):
+    user_id = load_user_id(scope)
+    if user_id is None:
+        await send_json(send, {"error": "Login required"}, 401)
+        return
+    body = await read_body(receive)
+    if body is None:
+        return
+
+    turn, error = await run_in_app(start_chat_turn, user_id, json.loads(body or b"{}"))
+    if error:
+        message, status = error
+        await send_json(send, {"error": message}, status)
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+    })
+    reply = asyncio.create_task(stream_reply(send, *turn, user_id))
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    # Cancel the generation as soon as the client goes away
+    watcher = asyncio.create_task(watch_disconnect())
+    done, _ = await asyncio.wait({reply, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    if watcher in done:
+        reply.cancel()
+    else:
+        watcher.cancel()
+    try:
+        await reply
+    except asyncio.CancelledError:
+        return
+    await send({"type": "http.response.body", "body": b""})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(setup)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/send_message" and scope["method"] == "POST":
+        await send_message(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(
+        "asgi:application",
+        host=app.config['SERVER_HOST'],
+        port=app.config['SERVER_PORT'],
+        # Connections beyond this get a 503 instead of degrading every open stream
+        limit_concurrency=app.config['MAX_CONCURRENT_CONNECTIONS'],
+    )
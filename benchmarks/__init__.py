@@ -0,0 +1,11 @@
+"""
+Benchmarks and load tests, run from the app directory, e.g.
+
+    python -m benchmarks.bench_ingest
+    python -m benchmarks.bench_query --sizes 100,1000
+    python -m benchmarks.load_test --users 50
+    python -m benchmarks.compare old.json new.json
+
+Everything runs offline on a CPU: corpora are generated, embeddings come from a hashing
+embedder (--embedder model loads the real one) and Ollama is replaced by fake_ollama.py.
+"""
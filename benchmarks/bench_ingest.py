@@ -0,0 +1,104 @@
+"""
+Ingestion throughput on a synthetic corpus: extract_text_from_pdf (text layer and scanned),
+extract_text_from_image, and init_chromadb building the index from scratch and re-checking
+an unchanged corpus.
+
+    python -m benchmarks.bench_ingest --documents 40 --pages 3 --scanned-share 0.25 --images 10
+
+Scanned PDFs and images need the tesseract binary; without it they are left out of the corpus.
+"""
+import argparse
+import os
+import time
+import fitz
+from benchmarks import corpus
+from benchmarks.common import (
+    add_common_arguments, cleanup_workdir, configure_tesseract, make_workdir, prepare_environment,
+    summarize, use_embedder, write_report,
+)
+
+def page_count(path):
+    if not path.endswith(".pdf"):
+        return 1
+    with fitz.open(path) as document:
+        return document.page_count
+
+def has_text_layer(path):
+    with fitz.open(path) as document:
+        return bool(document[0].get_text().strip())
+
+def time_extraction(function, paths):
+    latencies = []
+    characters = 0
+    for path in paths:
+        start = time.perf_counter()
+        text = function(path)
+        latencies.append(time.perf_counter() - start)
+        characters += len(text)
+    pages = sum(page_count(path) for path in paths)
+    total = sum(latencies)
+    return {
+        "files": len(paths),
+        "latency": summarize(latencies),
+        "files_per_second": round(len(paths) / total, 2) if total else None,
+        "pages_per_second": round(pages / total, 2) if total else None,
+        "characters": characters,
+    }
+
+def time_init(rag_utils, documents_directory, files):
+    start = time.perf_counter()
+    rag_utils.init_chromadb(documents_directory)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": round(seconds, 3),
+        "files_per_second": round(files / seconds, 2),
+        "chunks": rag_utils.client.get_collection("documents").count(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--scanned-share", type=float, default=0.25)
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="INGEST_WORKERS for the run")
+    parser.add_argument("--seed", type=int, default=0)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = make_workdir(args.workdir)
+    prepare_environment(workdir, INGEST_WORKERS=args.workers)
+    import ocr_utils
+    import rag_utils
+
+    if not configure_tesseract() and (args.scanned_share or args.images):
+        print("tesseract not found, benchmarking without scanned PDFs and images")
+        args.scanned_share, args.images = 0.0, 0
+    documents_directory = os.path.join(workdir, "RAG_scannable_documents")
+    print(f"Generating corpus in {documents_directory}")
+    paths = corpus.generate(
+        documents_directory, args.documents, args.pages, "pdf", args.scanned_share, args.images, args.seed
+    )
+    pdfs = [path for path in paths if path.endswith(".pdf")]
+    scanned = [path for path in pdfs if not has_text_layer(path)]
+    images = [path for path in paths if path.endswith(".png")]
+    use_embedder(args.embedder)
+
+    results = {
+        "extract_text_from_pdf": time_extraction(ocr_utils.extract_text_from_pdf, [p for p in pdfs if p not in scanned]),
+    }
+    if scanned:
+        results["extract_text_from_pdf_scanned"] = time_extraction(ocr_utils.extract_text_from_pdf, scanned)
+    if images:
+        results["extract_text_from_image"] = time_extraction(ocr_utils.extract_text_from_image, images)
+    # The extraction functions don't fill the index's text cache, so this run extracts everything again
+    results["init_chromadb_cold"] = cold = time_init(rag_utils, documents_directory, len(paths))
+    cold["chunks_per_second"] = round(cold["chunks"] / cold["seconds"], 2)
+    results["init_chromadb_unchanged"] = time_init(rag_utils, documents_directory, len(paths))
+
+    parameters = {name: value for name, value in vars(args).items() if name not in ("workdir", "keep", "output")}
+    write_report("ingest", parameters, results, args.output)
+    cleanup_workdir(args, workdir)
+
+if __name__ == '__main__':
+    main()
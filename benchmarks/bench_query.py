@@ -0,0 +1,89 @@
+"""
+query_context latency at growing corpus sizes, with the time spent in each retrieval stage.
+
+    python -m benchmarks.bench_query --sizes 100,500,2000 --queries 200
+
+The corpus (plain text files) grows in place from one size to the next, each step is indexed
+incrementally before its queries run. Every query is distinct, the query embedding cache is
+cleared between sizes.
+"""
+import argparse
+import os
+import time
+from benchmarks import corpus
+from benchmarks.common import (
+    add_common_arguments, cleanup_workdir, make_workdir, prepare_environment, summarize, use_embedder,
+    write_report,
+)
+
+def run_queries(rag_utils, queries, n_results, filter_share):
+    from metrics import Trace, current_trace
+    latencies = []
+    stages = {}
+    for number, (subject, query) in enumerate(queries):
+        # Some queries are restricted to their subject, like those from a chat named after it
+        filters = None
+        if filter_share and number % round(1 / filter_share) == 0:
+            filters = {"subject": subject.lower()}
+        trace = Trace("benchmark")
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            rag_utils.query_context(query, n_results=n_results, filters=filters)
+        finally:
+            latencies.append(time.perf_counter() - start)
+            current_trace.reset(token)
+        for stage, seconds in trace.spans.items():
+            stages.setdefault(stage, []).append(seconds)
+    return latencies, stages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,500,2000", help="Comma separated corpus sizes in documents")
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed queries before each size")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--filter-share", type=float, default=0.25, help="Share of queries with a subject filter")
+    parser.add_argument("--seed", type=int, default=0)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+
+    workdir = make_workdir(args.workdir)
+    prepare_environment(workdir)
+    import rag_utils
+    use_embedder(args.embedder)
+
+    documents_directory = os.path.join(workdir, "RAG_scannable_documents")
+    queries = corpus.generate_queries(args.warmup + args.queries, args.seed)
+    results = {}
+    written = 0
+    for size in sizes:
+        print(f"Growing the corpus to {size} documents")
+        corpus.generate(documents_directory, size, args.pages, "txt", seed=args.seed, start=written)
+        written = size
+        start = time.perf_counter()
+        rag_utils.init_chromadb(documents_directory)
+        index_seconds = time.perf_counter() - start
+
+        rag_utils.embed_query.cache_clear()
+        run_queries(rag_utils, queries[:args.warmup], args.n_results, args.filter_share)
+        rag_utils.embed_query.cache_clear()
+        start = time.perf_counter()
+        latencies, stages = run_queries(rag_utils, queries[args.warmup:], args.n_results, args.filter_share)
+        seconds = time.perf_counter() - start
+        results[f"documents_{size}"] = {
+            "chunks": rag_utils.client.get_collection("documents").count(),
+            "index_seconds": round(index_seconds, 3),
+            "query_context": summarize(latencies),
+            "queries_per_second": round(len(latencies) / seconds, 2),
+            "stages": {stage: summarize(samples) for stage, samples in stages.items()},
+        }
+
+    parameters = {name: value for name, value in vars(args).items() if name not in ("workdir", "keep", "output")}
+    write_report("query", parameters, results, args.output)
+    cleanup_workdir(args, workdir)
+
+if __name__ == '__main__':
+    main()
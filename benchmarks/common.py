@@ -0,0 +1,158 @@
+"""
+Shared helpers: an isolated working directory per run, the hashing embedder and JSON reports.
+
+prepare_environment() has to run before any app module is imported, the app reads its
+configuration at import time.
+"""
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIRECTORY = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+def add_common_arguments(parser):
+    parser.add_argument("--workdir", help="Directory for the corpus, index and database (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory afterwards")
+    parser.add_argument("--embedder", choices=("hash", "model"), default="hash",
+                        help="hash: fast offline stand-in, model: the real sentence-transformers model")
+    parser.add_argument("--output", help="Report path (default: benchmarks/results/<name>-<commit>-<time>.json)")
+
+def make_workdir(path=None):
+    if path:
+        os.makedirs(path, exist_ok=True)
+        return os.path.abspath(path)
+    return tempfile.mkdtemp(prefix="kzu-bench-")
+
+def cleanup_workdir(args, workdir):
+    if args.keep or args.workdir:
+        print(f"Working directory kept: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def benchmark_environment(workdir, **overrides):
+    """Environment variables pointing the app's index, database and stores into workdir."""
+    env = {
+        "CHROMA_PERSIST_DIRECTORY": os.path.join(workdir, "chroma_db"),
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "app.db"),
+        "UPLOAD_STORE_PATH": os.path.join(workdir, "upload_store.sqlite3"),
+        "PROMPT_LOG_SAMPLE_RATE": "0",
+    }
+    env.update({name: str(value) for name, value in overrides.items()})
+    return env
+
+def prepare_environment(workdir, **overrides):
+    """Configure this process for a run in workdir, call before importing app modules."""
+    os.environ.update(benchmark_environment(workdir, **overrides))
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+def configure_tesseract():
+    """Point pytesseract at the local tesseract binary, returns False if there is none."""
+    import pytesseract
+    path = shutil.which("tesseract")
+    if path is None:
+        return False
+    pytesseract.pytesseract.tesseract_cmd = path
+    return True
+
+class HashEmbedder:
+    """
+    Offline stand-in for the sentence-transformers model: hashed bag of words, L2-normalised.
+    Costs next to nothing, so index and search timings are not dominated by the model.
+    """
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+
+    def _vector(self, text):
+        import numpy as np
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimensions] += 1.0 if value & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        import numpy as np
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        return np.array([self._vector(text) for text in sentences])
+
+def use_embedder(name):
+    """Install the chosen embedder in rag_utils, the real model is loaded here so runs don't time it."""
+    import rag_utils
+    if name == "hash":
+        rag_utils.embedding_model = HashEmbedder()
+    else:
+        rag_utils.get_embedding_model()
+
+def percentile(sorted_values, q):
+    """q-th percentile (0-100) of sorted values, interpolating between ranks."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(samples):
+    """Latency summary of samples in seconds, reported in milliseconds."""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    milliseconds = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "count": len(values),
+        "mean_ms": milliseconds(sum(values) / len(values)),
+        "min_ms": milliseconds(values[0]),
+        "p50_ms": milliseconds(percentile(values, 50)),
+        "p95_ms": milliseconds(percentile(values, 95)),
+        "p99_ms": milliseconds(percentile(values, 99)),
+        "max_ms": milliseconds(values[-1]),
+    }
+
+def git_version():
+    def git(*args):
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=REPO_ROOT, capture_output=True, text=True, timeout=10
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+def write_report(name, parameters, results, output=None):
+    """Save a run as JSON, see compare.py for comparing two of them."""
+    version = git_version()
+    report = {
+        "benchmark": name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": version,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": parameters,
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIRECTORY, f"{name}-{version['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Report written to {output}")
+    return output
@@ -0,0 +1,73 @@
+"""
+Compare two benchmark reports of the same benchmark, e.g. before and after a change.
+
+    python -m benchmarks.compare benchmarks/results/query-abc123-....json benchmarks/results/query-def456-....json
+
+Prints every latency percentile and throughput figure side by side. Exits with status 1
+when one got worse by more than --threshold percent: latencies (*_ms) going up or
+throughput (*_per_second) going down.
+"""
+import argparse
+import json
+import sys
+
+def flatten(results, prefix=""):
+    """{"a": {"p50_ms": 1}} -> {"a.p50_ms": 1}, numbers only."""
+    values = {}
+    for name, value in results.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict):
+            values.update(flatten(value, key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[key] = value
+    return values
+
+def direction(key):
+    """1 if larger is better, -1 if smaller is better, 0 if the value is informational."""
+    name = key.rsplit(".", 1)[-1]
+    if name.endswith("_per_second"):
+        return 1
+    if name.startswith(("p50", "p95", "p99", "mean")) and name.endswith("_ms"):
+        return -1
+    return 0
+
+def compare(baseline, candidate, threshold):
+    """Return rows of (key, old, new, change in percent, regressed)."""
+    old, new = flatten(baseline["results"]), flatten(candidate["results"])
+    rows = []
+    for key in old:
+        if key not in new or not direction(key):
+            continue
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        rows.append((key, old[key], new[key], change, -direction(key) * change > threshold))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change counted as a regression")
+    args = parser.parse_args()
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline["benchmark"] != candidate["benchmark"]:
+        raise SystemExit(f"Different benchmarks: {baseline['benchmark']} and {candidate['benchmark']}")
+    if baseline["parameters"] != candidate["parameters"]:
+        print("Warning: the runs used different parameters")
+
+    versions = [report["version"]["commit"] or "?" for report in (baseline, candidate)]
+    rows = compare(baseline, candidate, args.threshold)
+    width = max((len(key) for key, *_ in rows), default=10)
+    print(f"{'':{width}}  {versions[0]:>12}  {versions[1]:>12}  {'change':>8}")
+    for key, old, new, change, regressed in rows:
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{key:{width}}  {old:12.3f}  {new:12.3f}  {change:+7.1f}%{marker}")
+    regressions = sum(regressed for *_, regressed in rows)
+    if regressions:
+        print(f"{regressions} figure(s) worse by more than {args.threshold}%")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Synthetic, reproducible document corpus laid out like the real one
+(Subjects/<Subject>/<Teacher>/...), with questions that match its contents.
+
+    python -m benchmarks.corpus out_dir --documents 200 --format pdf --scanned-share 0.2 --images 20
+
+PDFs get a text layer unless they are "scanned" (pages stored as images, so they go through
+OCR), images are rendered text for OCR.
+"""
+import argparse
+import os
+import random
+
+SUBJECTS = {
+    "Mathematik": ["Ableitung", "Integral", "Funktion", "Grenzwert", "Vektor", "Matrix", "Wahrscheinlichkeit",
+                   "Gleichung", "Parabel", "Logarithmus", "Exponentialfunktion", "Stammfunktion"],
+    "Biologie": ["Zelle", "Mitose", "Meiose", "Enzym", "Photosynthese", "Evolution", "Genetik", "Protein",
+                 "Membran", "Chromosom", "Ökosystem", "Mutation"],
+    "Geschichte": ["Revolution", "Reformation", "Industrialisierung", "Weltkrieg", "Bundesstaat", "Verfassung",
+                   "Imperialismus", "Aufklärung", "Mittelalter", "Kalter Krieg", "Demokratie", "Monarchie"],
+    "Chemie": ["Atom", "Molekül", "Säure", "Base", "Oxidation", "Reduktion", "Elektron", "Ionenbindung",
+               "Katalysator", "Reaktion", "Periodensystem", "Titration"],
+    "Englisch": ["grammar", "tense", "essay", "novel", "vocabulary", "conditional", "passive voice",
+                 "Shakespeare", "argument", "summary", "poem", "narrative"],
+}
+TEACHERS = ["Mueller", "Keller", "Meier", "Brunner"]
+DOC_TYPES = ["Zusammenfassung", "Pruefung", "Arbeitsblatt", "Loesungen", "Notizen"]
+FILLER = ("der die das und ist wird mit für von bei eine einer den dem im auf als zum zur wie "
+          "man kann beschreibt erklärt zeigt Beispiel Aufgabe Lösung Schritt Regel Definition "
+          "wichtig zuerst danach immer deshalb Prozess Ergebnis Theorie Übung Frage").split()
+
+def sentence(rng, terms):
+    words = rng.choices(FILLER, k=rng.randint(8, 14)) + rng.sample(terms, 2)
+    rng.shuffle(words)
+    return " ".join(words).capitalize() + "."
+
+def page_text(rng, terms, words=250):
+    sentences = []
+    while sum(len(s.split()) for s in sentences) < words:
+        sentences.append(sentence(rng, terms))
+    return " ".join(sentences)
+
+def document_path(directory, index, subject, teacher, doc_type, extension):
+    folder = os.path.join(directory, "Subjects", subject, teacher)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{doc_type}_{index:05d}{extension}")
+
+def write_pdf(path, pages, scanned, dpi=100):
+    import fitz
+    document = fitz.open()
+    # Scanned pages are typeset on a scratch document and only their picture is kept
+    scratch = fitz.open() if scanned else document
+    for text in pages:
+        page = scratch.new_page()
+        page.insert_textbox(page.rect + (50, 50, -50, -50), text, fontsize=10)
+        if scanned:
+            scan = document.new_page(width=page.rect.width, height=page.rect.height)
+            scan.insert_image(scan.rect, pixmap=page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY))
+    document.save(path)
+    document.close()
+    if scanned:
+        scratch.close()
+
+def write_image(path, text, dpi=100):
+    import fitz
+    document = fitz.open()
+    page = document.new_page(width=595, height=420)
+    page.insert_textbox(page.rect + (30, 30, -30, -30), text, fontsize=12)
+    page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).save(path)
+    document.close()
+
+def generate(directory, documents, pages=2, fmt="txt", scanned_share=0.0, images=0, seed=0, start=0):
+    """
+    Write documents start..documents-1 (so a corpus can be grown step by step) plus images
+    start..images-1. Returns the paths written. The same seed always gives the same corpus.
+    """
+    paths = []
+    for index in range(start, documents):
+        rng = random.Random(f"{seed}:document:{index}")
+        subject = rng.choice(sorted(SUBJECTS))
+        terms = SUBJECTS[subject]
+        extension = ".pdf" if fmt == "pdf" else ".txt"
+        path = document_path(directory, index, subject, rng.choice(TEACHERS), rng.choice(DOC_TYPES), extension)
+        texts = [page_text(rng, terms) for _ in range(pages)]
+        if fmt == "pdf":
+            write_pdf(path, texts, scanned=rng.random() < scanned_share)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(texts))
+        paths.append(path)
+    for index in range(start, images):
+        rng = random.Random(f"{seed}:image:{index}")
+        subject = rng.choice(sorted(SUBJECTS))
+        path = document_path(directory, index, subject, rng.choice(TEACHERS), "Notizen_Foto", ".png")
+        write_image(path, page_text(rng, SUBJECTS[subject], words=80))
+        paths.append(path)
+    return paths
+
+def generate_queries(count, seed=0):
+    """Distinct questions about the corpus' topics, as (subject, question)."""
+    rng = random.Random(f"{seed}:queries")
+    templates = ["Was ist {} und wie hängt es mit {} zusammen?", "Erkläre {} am Beispiel {}.",
+                 "Wie unterscheiden sich {} und {}?", "Fasse {} und {} zusammen."]
+    queries = []
+    seen = set()
+    while len(queries) < count:
+        subject = rng.choice(sorted(SUBJECTS))
+        question = rng.choice(templates).format(*rng.sample(SUBJECTS[subject], 2))
+        if question in seen:
+            question += f" ({len(queries)})"
+        seen.add(question)
+        queries.append((subject, question))
+    return queries
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic document corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--format", choices=("txt", "pdf"), default="pdf")
+    parser.add_argument("--scanned-share", type=float, default=0.0, help="Share of PDFs without a text layer")
+    parser.add_argument("--images", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    written = generate(args.directory, args.documents, args.pages, args.format, args.scanned_share, args.images, args.seed)
+    print(f"Wrote {len(written)} files to {args.directory}")
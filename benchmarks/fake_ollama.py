@@ -0,0 +1,144 @@
+"""
+Stand-in for the Ollama server: answers /api/chat and /api/generate with filler tokens at a
+fixed rate, streamed or not, so load tests measure the app instead of the model.
+
+    python -m benchmarks.fake_ollama --port 11435 --tokens-per-second 30 --tokens 200
+    OLLAMA_HOST=http://127.0.0.1:11435 python asgi.py
+
+Every request is served on its own thread, the rate holds for each stream independently.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tokens=200, tokens_per_second=30.0, first_token_ms=200.0):
+        super().__init__(address, FakeOllamaHandler)
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.first_token_ms = first_token_ms
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "max_concurrent": self.max_active}
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/generate"):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self._answer(body, chat=self.path == "/api/chat")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the generation
+            pass
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _answer(self, body, chat):
+        server = self.server
+        started = time.perf_counter()
+        # Prompt evaluation
+        time.sleep(server.first_token_ms / 1000)
+        prompt_done = time.perf_counter()
+        interval = 1 / server.tokens_per_second if server.tokens_per_second > 0 else 0
+        stream = body.get("stream", True)
+        if stream:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+        tokens = []
+        for number in range(server.tokens):
+            if number:
+                time.sleep(interval)
+            token = f"token{number} "
+            tokens.append(token)
+            if stream:
+                self._send_chunk(self._message(body, token, chat, done=False))
+        finished = time.perf_counter()
+        final = self._message(body, "" if stream else "".join(tokens), chat, done=True)
+        final.update(
+            done_reason="stop",
+            total_duration=int((finished - started) * 1e9),
+            prompt_eval_count=len(json.dumps(body.get("messages") or body.get("prompt") or "")) // 4,
+            prompt_eval_duration=int((prompt_done - started) * 1e9),
+            eval_count=server.tokens,
+            eval_duration=int((finished - prompt_done) * 1e9),
+        )
+        if stream:
+            self._send_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        else:
+            self._send_json(final)
+
+    def _message(self, body, text, chat, done):
+        message = {"model": body.get("model", ""), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"), "done": done}
+        if chat:
+            message["message"] = {"role": "assistant", "content": text}
+        else:
+            message["response"] = text
+        return message
+
+    def _send_chunk(self, message):
+        line = (json.dumps(message) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, message):
+        data = json.dumps(message).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start(host="127.0.0.1", port=0, **options):
+    """Serve on a background thread, returns the server (its address is server.server_address)."""
+    server = FakeOllamaServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake Ollama server streaming tokens at a fixed rate")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens per answer")
+    parser.add_argument("--tokens-per-second", type=float, default=30.0, help="Rate of every stream, 0 for no delay")
+    parser.add_argument("--first-token-ms", type=float, default=200.0, help="Simulated prompt evaluation time")
+    args = parser.parse_args()
+    server = FakeOllamaServer(
+        (args.host, args.port), tokens=args.tokens, tokens_per_second=args.tokens_per_second,
+        first_token_ms=args.first_token_ms,
+    )
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,222 @@
+"""
+Concurrent /send_message load test against the app backed by fake_ollama.py.
+
+    python -m benchmarks.load_test --users 50 --requests 4 --tokens-per-second 30
+
+Starts the fake Ollama server and the app (asgi.py, or the Flask server with --server flask)
+on a small synthetic corpus in a scratch directory, registers --users users and lets them
+all chat at once. Reports time to first token and complete answer latency as seen by the
+clients, throughput, and the server's own stage timings from /metrics.
+With --url an already running app is tested instead; it has to talk to a fake Ollama itself.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from benchmarks import corpus, fake_ollama
+from benchmarks.common import (
+    REPO_ROOT, add_common_arguments, benchmark_environment, cleanup_workdir, make_workdir, summarize,
+    write_report,
+)
+
+STATUS_PREFIX = "\x1e"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_app(args, workdir, ollama_address):
+    port = free_port()
+    env = dict(os.environ)
+    env.update(benchmark_environment(
+        workdir,
+        OLLAMA_HOST=f"http://{ollama_address[0]}:{ollama_address[1]}",
+        LLM_MAX_CONCURRENT=args.llm_concurrency,
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")])),
+    ))
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve_app", "--server", args.server, "--port", str(port),
+         "--embedder", args.embedder],
+        # The app looks for its documents relative to the working directory
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+def wait_until_ready(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit("The app exited during startup, see server.log in the working directory")
+        try:
+            with urllib.request.urlopen(url + "/ready", timeout=5):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.5)
+    raise SystemExit(f"The app was not ready after {timeout}s")
+
+class ChatUser:
+    """One logged in user with a chat session named after a subject."""
+
+    def __init__(self, url, name, subject):
+        self.url = url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        credentials = {"username": name, "password": "benchmark"}
+        self._post_form("/register", credentials)
+        self._post_form("/login", credentials)
+        page = self._post_form("/create_session", {"session_name": subject})
+        sessions = re.findall(r'data-session-id="(\d+)">([^<]*)<', page)
+        self.session_id = int([session_id for session_id, title in sessions if title == subject][-1])
+
+    def _post_form(self, path, fields):
+        data = urllib.parse.urlencode(fields).encode("utf-8")
+        with self.opener.open(self.url + path, data=data, timeout=30) as response:
+            return response.read().decode("utf-8")
+
+    def send_message(self, message, timeout):
+        """Stream one answer, returns (seconds to first token or None, total seconds, answer)."""
+        request = urllib.request.Request(
+            self.url + "/send_message",
+            data=json.dumps({"message": message, "session_id": self.session_id}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        start = time.perf_counter()
+        first_token = None
+        received = ""
+        with self.opener.open(request, timeout=timeout) as response:
+            while True:
+                data = response.read1(4096)
+                if not data:
+                    break
+                received += data.decode("utf-8", errors="replace")
+                if first_token is None and answer_text(received).strip():
+                    first_token = time.perf_counter() - start
+        return first_token, time.perf_counter() - start, answer_text(received)
+
+def answer_text(received):
+    """The streamed answer without the queue status lines in front of it."""
+    while received.startswith(STATUS_PREFIX):
+        end = received.find("\n")
+        if end < 0:
+            return ""
+        received = received[end + 1:]
+    return received
+
+def server_stage_means(url):
+    """Mean seconds per chat stage, in milliseconds, from the app's /metrics."""
+    try:
+        with urllib.request.urlopen(url + "/metrics", timeout=10) as response:
+            text = response.read().decode("utf-8")
+    except urllib.error.URLError:
+        return {}
+    sums = dict(re.findall(r"^kzu_chat_(\w+)_seconds_sum (\S+)$", text, re.M))
+    counts = dict(re.findall(r"^kzu_chat_(\w+)_seconds_count (\S+)$", text, re.M))
+    return {
+        stage: round(float(sums[stage]) / float(count) * 1000, 3)
+        for stage, count in counts.items() if float(count)
+    }
+
+def run_user(user, questions, args, barrier, samples, errors, lock):
+    barrier.wait()
+    for question in questions:
+        try:
+            first_token, seconds, answer = user.send_message(question, args.request_timeout)
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        with lock:
+            samples.append((first_token, seconds, len(answer.split())))
+        if args.think_time:
+            time.sleep(args.think_time)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="Concurrent users")
+    parser.add_argument("--requests", type=int, default=3, help="Messages each user sends, one after the other")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds a user waits between messages")
+    parser.add_argument("--server", choices=("asgi", "flask"), default="asgi")
+    parser.add_argument("--url", help="Test a running app instead of starting one")
+    parser.add_argument("--llm-concurrency", type=int, default=2, help="LLM_MAX_CONCURRENT of the started app")
+    parser.add_argument("--tokens", type=int, default=100, help="Tokens per fake answer")
+    parser.add_argument("--tokens-per-second", type=float, default=30.0, help="Rate of every fake answer stream")
+    parser.add_argument("--first-token-ms", type=float, default=200.0, help="Fake prompt evaluation time")
+    parser.add_argument("--documents", type=int, default=50, help="Size of the synthetic corpus")
+    parser.add_argument("--request-timeout", type=float, default=600.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = make_workdir(args.workdir)
+    ollama = None
+    process = None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            ollama = fake_ollama.start(
+                tokens=args.tokens, tokens_per_second=args.tokens_per_second, first_token_ms=args.first_token_ms
+            )
+            corpus.generate(os.path.join(workdir, "RAG_scannable_documents"), args.documents, seed=args.seed)
+            process, url = start_app(args, workdir, ollama.server_address)
+        print(f"Waiting for {url}")
+        wait_until_ready(url, process, args.ready_timeout)
+
+        questions = corpus.generate_queries(args.users * args.requests, args.seed)
+        run_id = f"{os.getpid()}{int(time.time())}"
+        users = []
+        for number in range(args.users):
+            mine = questions[number * args.requests:(number + 1) * args.requests]
+            users.append((ChatUser(url, f"bench{run_id}u{number}", mine[0][0]), [question for _, question in mine]))
+
+        print(f"{args.users} users sending {args.requests} messages each")
+        samples, errors, lock = [], {}, threading.Lock()
+        barrier = threading.Barrier(args.users + 1)
+        threads = [
+            threading.Thread(target=run_user, args=(user, mine, args, barrier, samples, errors, lock))
+            for user, mine in users
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        results = {
+            "requests": len(samples),
+            "errors": errors,
+            "wall_seconds": round(seconds, 3),
+            "time_to_first_token": summarize([first for first, _, _ in samples if first is not None]),
+            "latency": summarize([total for _, total, _ in samples]),
+            "requests_per_second": round(len(samples) / seconds, 3),
+            "tokens_per_second": round(sum(tokens for _, _, tokens in samples) / seconds, 2),
+            "server_stage_mean_ms": server_stage_means(url),
+        }
+        if ollama is not None:
+            results["fake_ollama"] = ollama.stats()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if ollama is not None:
+            ollama.shutdown()
+
+    parameters = {name: value for name, value in vars(args).items() if name not in ("workdir", "keep", "output")}
+    write_report("load", parameters, results, args.output)
+    cleanup_workdir(args, workdir)
+
+if __name__ == '__main__':
+    main()
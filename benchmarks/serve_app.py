@@ -0,0 +1,33 @@
+"""
+Runs the app for load_test.py with the chosen embedder installed. The environment
+(database, index, OLLAMA_HOST) comes from the load test.
+
+    python -m benchmarks.serve_app --server asgi --port 8765
+"""
+import argparse
+from benchmarks.common import use_embedder
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app for a load test")
+    parser.add_argument("--server", choices=("asgi", "flask"), default="asgi",
+                        help="asgi: production entry point, flask: threaded development server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--embedder", choices=("hash", "model"), default="hash")
+    args = parser.parse_args()
+
+    use_embedder(args.embedder)
+    if args.server == "asgi":
+        import uvicorn
+        import asgi
+        uvicorn.run(
+            asgi.application, host=args.host, port=args.port, log_level="warning",
+            limit_concurrency=asgi.app.config['MAX_CONCURRENT_CONNECTIONS'],
+        )
+    else:
+        from app import app, setup
+        setup()
+        app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
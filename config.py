@@ -3,7 +3,89 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Prompt history: the recent turns within a token budget, single messages (e.g. attached
+    # documents) are cut to a maximum length. Beyond HISTORY_MAX_TURNS turns or the budget, the
+    # oldest SUMMARY_FOLD_MESSAGES messages are folded into a per-session summary at once, so
+    # the prompt prefix Ollama has cached stays the same for several turns.
+    HISTORY_MAX_TURNS = int(os.environ.get('HISTORY_MAX_TURNS', 8))
+    HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 2000))
+    HISTORY_MESSAGE_MAX_TOKENS = int(os.environ.get('HISTORY_MESSAGE_MAX_TOKENS', 600))
+    SUMMARY_FOLD_MESSAGES = int(os.environ.get('SUMMARY_FOLD_MESSAGES', 6))
+    SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'gemma3:27b')
+    # How long Ollama keeps the model (and its prompt cache) loaded after a request, e.g. '30m',
+    # seconds or -1 for always, and its context size in tokens (0 = the model's default).
+    CHAT_KEEP_ALIVE = os.environ.get('CHAT_KEEP_ALIVE', '30m')
+    CHAT_NUM_CTX = int(os.environ.get('CHAT_NUM_CTX', 8192))
+    # Generations running on the model at once (per process), summary updates included; queued
+    # clients get their position every QUEUE_STATUS_INTERVAL seconds. Summaries run while no
+    # chat request waits, or take the next free slot after LLM_BACKGROUND_MAX_WAIT seconds;
+    # one that got no slot within SUMMARY_WAIT_TIMEOUT seconds is retried after the next reply.
+    LLM_MAX_CONCURRENT = int(os.environ.get('LLM_MAX_CONCURRENT', 2))
+    LLM_BACKGROUND_MAX_WAIT = float(os.environ.get('LLM_BACKGROUND_MAX_WAIT', 30.0))
+    SUMMARY_WAIT_TIMEOUT = float(os.environ.get('SUMMARY_WAIT_TIMEOUT', 300.0))
+    QUEUE_STATUS_INTERVAL = float(os.environ.get('QUEUE_STATUS_INTERVAL', 1.0))
+    # Opt-in semantic cache of answers: questions at least RESPONSE_CACHE_SIMILARITY cosine-similar
+    # to an earlier one that retrieved the same passages get the earlier answer. Only the first
+    # message of a conversation is cached, follow-ups depend on what was said before.
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+    RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', 0.95))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 24 * 3600))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+    RESPONSE_CACHE_MAX_QUERY_TOKENS = int(os.environ.get('RESPONSE_CACHE_MAX_QUERY_TOKENS', 200))
+    # Share of chat requests whose full prompt, retrieval results and answer are printed
+    # (0 = none, 1 = all). Per-request stage timings are always printed and served at /metrics.
+    PROMPT_LOG_SAMPLE_RATE = float(os.environ.get('PROMPT_LOG_SAMPLE_RATE', 0.0))
+    # Production server (asgi.py): bind address and the maximum number of open connections.
+    SERVER_HOST = os.environ.get('SERVER_HOST', '127.0.0.1')
+    SERVER_PORT = int(os.environ.get('SERVER_PORT', 8000))
+    MAX_CONCURRENT_CONNECTIONS = int(os.environ.get('MAX_CONCURRENT_CONNECTIONS', 1000))
+    WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 16))
+    # Background threads processing uploads.
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+    # Uploads waiting for their session's next message and upload job status, shared by all
+    # worker processes. Entries expire after UPLOAD_STORE_TTL seconds, the least recently used
+    # are evicted beyond UPLOAD_STORE_MAX_BYTES of extracted text.
+    UPLOAD_STORE_PATH = os.environ.get('UPLOAD_STORE_PATH') or os.path.join(basedir, 'upload_store.sqlite3')
+    UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 100 * 1024 * 1024))
+    UPLOAD_STORE_TTL = int(os.environ.get('UPLOAD_STORE_TTL', 3600))
+    # Shared embedding/retrieval process (rag_service.py) for multi-worker deployments, e.g.
+    # '/tmp/kzu-rag.sock' or '127.0.0.1:8765'. Unset, every process loads its own model and index.
+    RAG_SERVICE_ADDRESS = os.environ.get('RAG_SERVICE_ADDRESS') or None
+    # Secret the service and the workers authenticate each other with, required when using the service.
+    RAG_SERVICE_AUTHKEY = os.environ.get('RAG_SERVICE_AUTHKEY') or None
+    # How long the service waits for concurrent queries to encode them in one batch.
+    RAG_SERVICE_BATCH_WAIT_MS = float(os.environ.get('RAG_SERVICE_BATCH_WAIT_MS', 5))
+    # Files added, edited or deleted in the documents directory while running are indexed once
+    # the directory has been quiet for WATCH_DEBOUNCE_SECONDS. Without the watchdog package the
+    # directory is checked every WATCH_POLL_INTERVAL seconds.
+    WATCH_DOCUMENTS = os.environ.get('WATCH_DOCUMENTS', 'true').lower() in ('1', 'true', 'yes')
+    WATCH_DEBOUNCE_SECONDS = float(os.environ.get('WATCH_DEBOUNCE_SECONDS', 2.0))
+    WATCH_POLL_INTERVAL = float(os.environ.get('WATCH_POLL_INTERVAL', 5.0))
+    # On-disk ChromaDB index; the manifest of indexed files lives next to it.
+    CHROMA_PERSIST_DIRECTORY = os.environ.get('CHROMA_PERSIST_DIRECTORY') or os.path.join(basedir, 'chroma_db')
+    # Passage size for retrieval; distiluse only embeds the first 128 word pieces of a text.
+    CHUNK_TOKENS = int(os.environ.get('CHUNK_TOKENS', 128))
+    CHUNK_OVERLAP_TOKENS = int(os.environ.get('CHUNK_OVERLAP_TOKENS', 24))
+    # Worker processes for OCR during ingestion (1 disables the pool) and the page render resolution.
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))
+    OCR_DPI = int(os.environ.get('OCR_DPI', 200))
+    # Texts per embedding model call during ingestion, and how many recent query embeddings to keep.
+    EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 64))
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', 1024))
+    # Upper bound for the RAG context pasted into a prompt.
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1200))
+    # Hybrid retrieval: candidates taken from the vector and the keyword index each, merged with
+    # reciprocal-rank fusion (RETRIEVAL_RRF_K dampens the weight of the top ranks).
+    RETRIEVAL_CANDIDATES = int(os.environ.get('RETRIEVAL_CANDIDATES', 20))
+    RETRIEVAL_RRF_K = int(os.environ.get('RETRIEVAL_RRF_K', 60))
+    # Optional cross-encoder reranking of the fused candidates, e.g.
+    # 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'; stops scoring once the time budget is spent.
+    # Runs on the CPU by default so it doesn't take GPU memory from the chat model.
+    RERANK_MODEL = os.environ.get('RERANK_MODEL') or None
+    RERANK_DEVICE = os.environ.get('RERANK_DEVICE', 'cpu')
+    RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 20))
+    RERANK_TIME_BUDGET_MS = int(os.environ.get('RERANK_TIME_BUDGET_MS', 300))
 #configuring the database URI to use SQLite and setting the secret key for session management.
 # This configuration is used to set up the Flask application, including the database URI and secret key.
\ No newline at end of file
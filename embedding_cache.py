@@ -0,0 +1,36 @@
+import numpy as np
+from sqlite_store import SQLiteStore
+
+class EmbeddingCache(SQLiteStore):
+    """
+    Persistent embedding store keyed by (model name, content hash).
+    Lets re-uploads and index rebuilds skip the embedding model entirely for text it has seen before.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        " model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+        " PRIMARY KEY (model, content_hash))",
+    )
+
+    def get_many(self, model, content_hashes):
+        """Return {content_hash: vector} for the hashes that are cached."""
+        found = {}
+        content_hashes = list(content_hashes)
+        # Stay below SQLite's bound parameter limit
+        for start in range(0, len(content_hashes), 500):
+            batch = content_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+            for content_hash, vector in rows:
+                found[content_hash] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """Store (content_hash, vector) pairs."""
+        rows = [(model, content_hash, np.asarray(vector, dtype=np.float32).tobytes()) for content_hash, vector in items]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
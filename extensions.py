@@ -1,5 +1,24 @@
 # extensions.py
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every SQLite connection for many concurrent readers and short writes."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # Readers no longer block the writer saving a streamed answer, and vice versa
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL, only the last commits may be lost on power failure
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # Wait for a competing writer instead of failing with "database is locked"
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 # This file is used to initialize the database connection and ORM for the Flask application.
\ No newline at end of file
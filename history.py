@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from extensions import db
+from models import ChatSession, Message
+from rag_utils import estimate_tokens, truncate_to_tokens
+from prompts import model_options
+
+# Summaries are written by a single background thread, so two replies in the
+# same session can never fold the same turns twice.
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+# Maximum size of the transcript handed to the summarizer in one go
+SUMMARY_INPUT_TOKENS = 3000
+
+def message_text(msg, max_tokens=None):
+    return truncate_to_tokens(msg.full_content, max_tokens or Config.HISTORY_MESSAGE_MAX_TOKENS)
+
+def format_message(msg, max_tokens=None):
+    return f"{'User' if msg.is_user else 'Bot'}: {message_text(msg, max_tokens)}"
+
+def split_history(messages):
+    """
+    How many of the session's unsummarized messages (oldest first) are due to be folded into
+    the summary; the rest stay in the prompt verbatim. Messages leave SUMMARY_FOLD_MESSAGES at a
+    time, once more than HISTORY_MAX_TURNS turns or HISTORY_TOKEN_BUDGET tokens are pending, so
+    the history only grows at its end in between and the model can reuse its cached prefix.
+    The latest exchange always stays, see history_max_tokens() for when it alone is too long.
+    """
+    block = max(1, Config.SUMMARY_FOLD_MESSAGES)
+    keep_from = max(0, len(messages) - 2)
+    excess = max(0, len(messages) - Config.HISTORY_MAX_TURNS * 2)
+    start = -(-excess // block) * block
+    tokens = [estimate_tokens(message_text(msg)) for msg in messages]
+    while start < keep_from and sum(tokens[start:]) > Config.HISTORY_TOKEN_BUDGET:
+        start += block
+    return min(start, keep_from)
+
+def history_max_tokens(messages):
+    """
+    Length limit for the history messages: the usual one, or an even share of HISTORY_TOKEN_BUDGET
+    when the ones split_history() keeps would exceed it (e.g. an exchange about a long attachment).
+    """
+    kept = messages[split_history(messages):]
+    if sum(estimate_tokens(message_text(msg)) for msg in kept) <= Config.HISTORY_TOKEN_BUDGET:
+        return None
+    return min(Config.HISTORY_MESSAGE_MAX_TOKENS, max(1, Config.HISTORY_TOKEN_BUDGET // len(kept)))
+
+def build_history(chat_session, before_id=None):
+    """
+    Return (summary, messages) for the prompt: the rolling summary of older turns and every
+    message not yet folded into it, before before_id, as chat messages, oldest first.
+    Messages only leave the history once they are summarized (see split_history), so a summary
+    that is delayed (e.g. the model is busy) makes the prompt longer but never loses a turn.
+    """
+    query = Message.query.filter(
+        Message.session_id == chat_session.id,
+        Message.id > chat_session.summary_upto_id
+    )
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    recent = query.order_by(Message.timestamp.asc(), Message.id.asc()).all()
+    max_tokens = history_max_tokens(recent)
+    messages = [
+        {'role': 'user' if msg.is_user else 'assistant', 'content': message_text(msg, max_tokens)}
+        for msg in recent
+    ]
+    return chat_session.summary or "", messages
+
+def update_rolling_summary(session_id, scheduler):
+    """
+    Fold the messages that leave the prompt history (see split_history) into the session
+    summary, so the model is only asked every few turns and only for the new part of the
+    conversation. A backlog is folded oldest block first, as much as fits into one request.
+    The model calls take background slots of the scheduler, so summaries run between answers
+    instead of competing with them for the model.
+    """
+    chat_session = db.session.get(ChatSession, session_id)
+    if chat_session is None:
+        return
+    while fold_into_summary(chat_session, scheduler):
+        pass
+
+def fold_into_summary(chat_session, scheduler):
+    """Summarize the oldest overflowing messages, returns False once there are none or no slot was free."""
+    pending = Message.query.filter(
+        Message.session_id == chat_session.id,
+        Message.id > chat_session.summary_upto_id
+    ).order_by(Message.timestamp.asc(), Message.id.asc()).all()
+    overflow = pending[:split_history(pending)]
+    if not overflow:
+        return False
+
+    # Whole blocks, oldest first, as long as they fit into the summarizer input
+    block = max(1, Config.SUMMARY_FOLD_MESSAGES)
+    lines = [format_message(msg, max_tokens=300) for msg in overflow]
+    count = block
+    while count < len(overflow) and sum(estimate_tokens(line) for line in lines[:count + block]) <= SUMMARY_INPUT_TOKENS:
+        count += block
+    overflow, transcript = overflow[:count], lines[:count]
+
+    prompt = (
+        "Update the running summary of a conversation between a student and the KZU-AI tutor. "
+        "Keep facts, open questions, subjects, names and decisions that may matter later; drop small talk. "
+        "Write at most 200 words in the language of the conversation and reply with the summary only.\n\n"
+        f"Current summary:\n{chat_session.summary or '(none)'}\n\n"
+        "New part of the conversation:\n" + "\n".join(transcript)
+    )
+    import ollama
+    ticket = scheduler.submit_background(chat_session.id)
+    try:
+        if not ticket.wait(Config.SUMMARY_WAIT_TIMEOUT):
+            # The messages stay in the history until the next reply schedules another try
+            print(f"No model slot for the summary of session {chat_session.id}, trying again later")
+            return False
+        response = ollama.chat(Config.SUMMARY_MODEL, [{'role': 'user', 'content': prompt}], **model_options())
+    finally:
+        scheduler.release(ticket)
+    chat_session.summary = response['message']['content'].strip()
+    chat_session.summary_upto_id = overflow[-1].id
+    db.session.commit()
+    return True
+
+def schedule_summary_update(app, session_id, scheduler):
+    """Run update_rolling_summary in the background so it never delays a reply."""
+    def run():
+        with app.app_context():
+            try:
+                update_rolling_summary(session_id, scheduler)
+            except Exception as e:
+                print(f"Failed to update summary for session {session_id}: {e}")
+    summary_executor.submit(run)
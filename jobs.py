@@ -0,0 +1,87 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+class JobQueue:
+    """
+    Runs slow work (OCR, embedding, indexing) on a background thread pool.
+    Every job gets an ID whose state and progress can be polled while it runs.
+    With a store (see UploadStore.put_job/get_job) job status is shared with other processes,
+    so any worker can answer a status poll.
+    """
+
+    # Finished jobs are forgotten after this many seconds
+    RETENTION_SECONDS = 3600
+
+    def __init__(self, max_workers, store=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.store = store
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, owner=None, **kwargs):
+        """
+        Queue fn(*args, progress=callback, **kwargs) and return the job ID right away.
+        fn reports progress by calling callback(fraction, message).
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self._forget_finished(now)
+            self.jobs[job_id] = {
+                "id": job_id,
+                "owner": owner,
+                "state": "queued",
+                "progress": 0.0,
+                "message": "Waiting for a free worker",
+                "result": None,
+                "error": None,
+                "created": now,
+                "updated": now,
+            }
+            if self.store is not None:
+                self.store.put_job(self.jobs[job_id])
+        self.executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        """Return a snapshot of the job, or None if it is unknown."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        # Submitted by another process
+        return self.store.get_job(job_id) if self.store is not None else None
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields, updated=time.time())
+            # Written under the lock so the store never goes back to an older state
+            if self.store is not None:
+                self.store.put_job(job)
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, state="running", message="Started")
+
+        def progress(fraction, message=None):
+            self._update(job_id, progress=round(fraction, 3), message=message)
+
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._update(job_id, state="failed", error=str(e), message="Failed")
+        else:
+            self._update(job_id, state="done", progress=1.0, result=result, message="Done")
+
+    def _forget_finished(self, now):
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["state"] in ("done", "failed") and now - job["updated"] > self.RETENTION_SECONDS
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
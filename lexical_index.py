@@ -0,0 +1,131 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+# Words that match nearly every passage in our German/English corpus
+STOPWORDS = {
+    "der", "die", "das", "den", "dem", "des", "ein", "eine", "einer", "eines", "einem", "einen",
+    "und", "oder", "aber", "ist", "sind", "war", "wird", "werden", "zu", "zum", "zur", "im", "in",
+    "an", "am", "auf", "aus", "mit", "von", "vom", "für", "bei", "als", "auch", "nicht", "es",
+    "er", "sie", "wir", "ich", "du", "wie", "was", "wer", "dass", "so", "sich", "noch", "nur",
+    "the", "a", "and", "or", "but", "is", "are", "was", "were", "be", "to", "of",
+    "on", "at", "for", "with", "by", "as", "it", "this", "that", "what", "how", "who", "i", "you",
+}
+
+def tokenize(text):
+    """Lowercased word tokens; keeps codes like 'ahv2030', 'e-mail' or 'h2o' in one piece."""
+    return [token for token in re.findall(r"\w+(?:[-./]\w+)*", text.lower()) if token not in STOPWORDS]
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the same passages as the Chroma collection.
+    Finds exact terms (teacher names, formula symbols, test codes) that embeddings blur.
+    Kept in memory and saved as JSON next to the vector index.
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # chunk_id -> {"metadata", "length", "tf"}
+            self.docs = {}
+            self.postings = defaultdict(set)
+            self.total_length = 0
+
+    def load(self):
+        """Load the saved index, returns False if there is none."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                docs = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self.lock:
+            self.clear()
+            for chunk_id, doc in docs.items():
+                self._insert(chunk_id, doc)
+        return True
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.docs)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, chunk_id, text, metadata):
+        tokens = tokenize(text)
+        with self.lock:
+            self.remove(chunk_id)
+            self._insert(chunk_id, {
+                "metadata": metadata,
+                "length": len(tokens),
+                "tf": dict(Counter(tokens)),
+            })
+
+    def remove(self, chunk_id):
+        with self.lock:
+            doc = self.docs.pop(chunk_id, None)
+            if doc is None:
+                return
+            self.total_length -= doc["length"]
+            for term in doc["tf"]:
+                self.postings[term].discard(chunk_id)
+                if not self.postings[term]:
+                    del self.postings[term]
+
+    def remove_document(self, doc_hash):
+        """Remove every passage of the document with content hash doc_hash."""
+        with self.lock:
+            for chunk_id in [chunk_id for chunk_id, doc in self.docs.items() if doc["metadata"].get("doc_hash") == doc_hash]:
+                self.remove(chunk_id)
+
+    def metadata_values(self, key):
+        """Distinct values of a metadata key over all passages."""
+        with self.lock:
+            return {doc["metadata"][key] for doc in self.docs.values() if key in doc["metadata"]}
+
+    def search(self, query, n_results, where=None):
+        """
+        Return [(chunk_id, score)] of the best BM25 matches, best first.
+        where is a {metadata key: value} dict the passages have to match.
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            if not terms or not self.docs:
+                return []
+            doc_count = len(self.docs)
+            average_length = self.total_length / doc_count or 1
+            scores = defaultdict(float)
+            for term in terms:
+                matching = self.postings.get(term)
+                if not matching:
+                    continue
+                idf = math.log(1 + (doc_count - len(matching) + 0.5) / (len(matching) + 0.5))
+                for chunk_id in matching:
+                    doc = self.docs[chunk_id]
+                    if where and any(doc["metadata"].get(key) != value for key, value in where.items()):
+                        continue
+                    tf = doc["tf"][term]
+                    norm = self.K1 * (1 - self.B + self.B * doc["length"] / average_length)
+                    scores[chunk_id] += idf * tf * (self.K1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+    def _insert(self, chunk_id, doc):
+        self.docs[chunk_id] = doc
+        self.total_length += doc["length"]
+        for term in doc["tf"]:
+            self.postings[term].add(chunk_id)
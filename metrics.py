@@ -0,0 +1,203 @@
+"""
+Latency metrics for the chat pipeline.
+
+Code marks its stages with span("name"); every span feeds a Prometheus histogram
+(kzu_chat_<name>_seconds, served by /metrics) and, while a chat request is being
+handled, that request's trace. A finished trace prints one line with the timing
+of every stage, so a slow answer shows where its time went.
+Metrics are kept per process.
+"""
+import bisect
+import contextvars
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from config import Config
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 200)
+
+SPAN_HELP = {
+    "history_load": "Loading the bounded chat history",
+    "query_embedding": "Embedding the user's question",
+    "vector_search": "Nearest neighbour search in the vector index",
+    "keyword_search": "BM25 search in the keyword index",
+    "rerank": "Cross-encoder reranking",
+    "retrieval": "Complete RAG retrieval",
+    "prompt_build": "Building the prompt, history and retrieval included",
+    "queue_wait": "Waiting for a generation slot",
+    "time_to_first_token": "From calling the model to its first token",
+    "generation": "From calling the model to its last token",
+    "db_save": "Storing the answer",
+    "request": "Complete chat request",
+}
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def render(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+class Registry:
+    """Named metrics, created on first use. gauge() registers a callback read at scrape time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.gauges = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help_text, buckets)
+            return self.metrics[name]
+
+    def counter(self, name, help_text):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Counter(name, help_text)
+            return self.metrics[name]
+
+    def gauge(self, name, help_text, read):
+        with self.lock:
+            self.gauges[name] = (help_text, read)
+
+    def render(self):
+        """All metrics in the Prometheus text format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+            gauges = list(self.gauges.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, (help_text, read) in gauges:
+            try:
+                value = read()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class Trace:
+    """Stage timings of one chat request. verbose decides whether its prompt and answer are logged."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+        self.verbose = random.random() < Config.PROMPT_LOG_SAMPLE_RATE
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+def start_trace(session_id):
+    trace = Trace(session_id)
+    current_trace.set(trace)
+    registry.counter("kzu_chat_requests_total", "Chat requests handled").inc()
+    return trace
+
+def finish_trace(trace):
+    """Record the request's total time and print its timings as one line."""
+    record("request", time.perf_counter() - trace.started)
+    current_trace.set(None)
+    print("Chat timings " + json.dumps({"session_id": trace.session_id, "spans": trace.spans, **trace.fields}))
+
+def record(name, seconds):
+    registry.histogram(f"kzu_chat_{name}_seconds", SPAN_HELP.get(name, name)).observe(seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans[name] = round(trace.spans.get(name, 0.0) + seconds, 4)
+
+@contextmanager
+def span(name):
+    """Time the enclosed block as stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+class GenerationTimer:
+    """
+    Times a streamed answer: start it right before calling the model and pass every chunk to
+    chunk(). Uses Ollama's own token count and timing from the final chunk when present.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.chunks = 0
+        self.eval_count = None
+        self.eval_duration = None
+
+    def chunk(self, chunk):
+        if self.first_token is None and chunk['message']['content']:
+            self.first_token = time.perf_counter()
+            record("time_to_first_token", self.first_token - self.started)
+        self.chunks += 1
+        if chunk.get('eval_count'):
+            self.eval_count = chunk['eval_count']
+            self.eval_duration = (chunk.get('eval_duration') or 0) / 1e9
+
+    def finish(self):
+        seconds = time.perf_counter() - self.started
+        record("generation", seconds)
+        tokens = self.eval_count or self.chunks
+        if self.eval_duration:
+            seconds = self.eval_duration
+        elif self.first_token is not None:
+            seconds = time.perf_counter() - self.first_token
+        registry.counter("kzu_chat_generated_tokens_total", "Tokens generated for chat answers").inc(tokens)
+        if tokens and seconds > 0:
+            rate = tokens / seconds
+            registry.histogram("kzu_chat_tokens_per_second", "Generation speed of chat answers", RATE_BUCKETS).observe(rate)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.fields.update(tokens=tokens, tokens_per_second=round(rate, 1))
+
+def verbose():
+    """Whether to log full prompts and answers: decided per request, by PROMPT_LOG_SAMPLE_RATE."""
+    trace = current_trace.get()
+    if trace is not None:
+        return trace.verbose
+    return random.random() < Config.PROMPT_LOG_SAMPLE_RATE
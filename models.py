@@ -10,13 +10,71 @@ class User(db.Model):
 class ChatSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False, default="New Chat")
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     messages = db.relationship('Message', backref='session', lazy=True, cascade="all, delete-orphan")
+    # Rolling summary of the turns that no longer fit into the prompt history,
+    # covering every message up to and including summary_upto_id.
+    summary = db.Column(db.Text, nullable=True)
+    summary_upto_id = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
 
 class Message(db.Model):
+    # History and prompt building filter by session and page by time
+    __table_args__ = (db.Index('ix_message_session_timestamp', 'session_id', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
     is_user = db.Column(db.Boolean, default=True)  # True if user message, False if bot response.
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Document attached to a user message; its text is stored once in Attachment
+    attachment_key = db.Column(db.String(64), db.ForeignKey('attachment.key'), nullable=True)
+    attachment = db.relationship('Attachment', lazy=True)
+
+    @property
+    def full_content(self):
+        """The message as the model sees it, including the attached document's text."""
+        if self.attachment is None:
+            return self.content
+        return f"{self.content}\n\nContent:\n{self.attachment.content}"
+
+class Attachment(db.Model):
+    """Text extracted from an uploaded document, referenced by the messages it was attached to."""
+    key = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
+def delete_unreferenced_attachments(keys=None):
+    """
+    Delete attachments no message refers to any more, limited to keys if given. Attachments are
+    shared between messages, so they can't be deleted along with a message. Doesn't commit.
+    """
+    query = Attachment.query.filter(~Attachment.key.in_(
+        db.session.query(Message.attachment_key).filter(Message.attachment_key.isnot(None))
+    ))
+    if keys is not None:
+        query = query.filter(Attachment.key.in_(keys))
+    return query.delete(synchronize_session=False)
+
+
+# Columns added after the first release, db.create_all() does not add them to existing tables.
+ADDED_COLUMNS = [
+    ("chat_session", "summary", "TEXT"),
+    ("chat_session", "summary_upto_id", "INTEGER NOT NULL DEFAULT 0"),
+    ("message", "attachment_key", "VARCHAR(64) REFERENCES attachment(key)"),
+]
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models. Call after db.create_all()."""
+    inspector = db.inspect(db.engine)
+    for table, column, definition in ADDED_COLUMNS:
+        existing = {col["name"] for col in inspector.get_columns(table)}
+        if column not in existing:
+            db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    db.session.commit()
+
+    # Indexes added later are missing from tables created before them
+    for model in (ChatSession, Message):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
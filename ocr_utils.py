@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import pytesseract
+from PIL import Image
+import fitz  # PyMuPDF
+from config import Config
+
+# This module must stay free of heavy imports (embedding model, ChromaDB):
+# it is what the OCR worker processes import.
+
+# Configure Tesseract path for Windows
+pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+
+# Shared process pool for OCR, created on first use.
+_pool = None
+
+def get_pool():
+    """Return the shared OCR process pool, or None when INGEST_WORKERS disables it."""
+    global _pool
+    if Config.INGEST_WORKERS <= 1:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=Config.INGEST_WORKERS)
+    return _pool
+
+def ocr_image(image_path):
+    """OCR an image file, errors (e.g. Tesseract missing) are raised."""
+    with Image.open(image_path) as image:
+        return pytesseract.image_to_string(image).strip()
+
+def extract_text_from_image(image_path):
+    """Extract text from an image using Tesseract OCR."""
+    try:
+        return ocr_image(image_path)
+    except Exception as e:
+        print(f"Failed to extract text from image {image_path}: {e}")
+        return ""
+
+def ocr_pixmap(samples, width, height, mode):
+    """
+    OCR a rendered page handed over as raw pixel data, no temporary files involved.
+    Errors are raised, the whole file then counts as failed instead of as empty.
+    """
+    image = Image.frombytes(mode, (width, height), samples)
+    return pytesseract.image_to_string(image).strip()
+
+def render_page(page, dpi=None):
+    """Render a PDF page in grayscale, returns the arguments for ocr_pixmap."""
+    pix = page.get_pixmap(dpi=dpi or Config.OCR_DPI, colorspace=fitz.csGRAY)
+    return pix.samples, pix.width, pix.height, "L"
+
+class OcrQueue:
+    """Hands OCR jobs to the pool while keeping at most max_pending rendered pages in memory."""
+
+    def __init__(self, pool, max_pending=None):
+        self.pool = pool
+        self.max_pending = max_pending or 2 * Config.INGEST_WORKERS
+        self.pending = deque()
+
+    def submit(self, fn, *args):
+        if self.pool is None:
+            # No pool configured, run inline
+            return fn(*args)
+        while self.pending and self.pending[0].done():
+            self.pending.popleft()
+        while len(self.pending) >= self.max_pending:
+            # Errors are reported when the caller collects the result
+            self.pending.popleft().exception()
+        future = self.pool.submit(fn, *args)
+        self.pending.append(future)
+        return future
+
+def _submit_pages(file_path, queue, dpi):
+    """Start extraction of one file, returns [(page_number, text or Future)]."""
+    lower_path = file_path.lower()
+    if lower_path.endswith('.txt'):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return [(1, f.read())]
+    if lower_path.endswith(IMAGE_EXTENSIONS):
+        return [(1, queue.submit(ocr_image, file_path))]
+    if lower_path.endswith('.pdf'):
+        pages = []
+        pdf_document = fitz.open(file_path)
+        try:
+            for page_num in range(pdf_document.page_count):
+                page = pdf_document[page_num]
+                # Try to get text directly first
+                text = page.get_text()
+                if text.strip():
+                    pages.append((page_num + 1, text.strip()))
+                else:
+                    # If no text found, OCR the rendered page in a worker
+                    pages.append((page_num + 1, queue.submit(ocr_pixmap, *render_page(page, dpi))))
+        finally:
+            pdf_document.close()
+        return pages
+    return []
+
+def _collect_pages(pages):
+    """Wait for the OCR jobs of one file, dropping pages without text."""
+    collected = []
+    for page_num, text in pages:
+        if isinstance(text, Future):
+            text = text.result()
+        if text:
+            collected.append((page_num, text))
+    return collected
+
+def extract_pages_parallel(file_paths, dpi=None):
+    """
+    Extract many files at once, spreading every image and scanned page over the process pool.
+    Yields (path, [(page_number, text)]) in input order, pages is None if the file could not be read.
+    """
+    queue = OcrQueue(get_pool())
+    started = deque()
+    for file_path in file_paths:
+        try:
+            started.append((file_path, _submit_pages(file_path, queue, dpi)))
+        except Exception as e:
+            print(f"Failed to extract text from {file_path}: {e}")
+            started.append((file_path, None))
+        # Hand back files that are already finished while the pool keeps working
+        while started and _is_done(started[0][1]):
+            yield _finish(*started.popleft())
+    while started:
+        yield _finish(*started.popleft())
+
+def _is_done(pages):
+    return pages is None or all(not isinstance(text, Future) or text.done() for _, text in pages)
+
+def _finish(file_path, pages):
+    if pages is None:
+        return file_path, None
+    try:
+        return file_path, _collect_pages(pages)
+    except Exception as e:
+        print(f"Failed to extract text from {file_path}: {e}")
+        return file_path, None
+
+def extract_pages(file_path, dpi=None):
+    """Extract text from a supported document as [(page_number, text)], empty for unknown types."""
+    _, pages = next(extract_pages_parallel([file_path], dpi))
+    return pages or []
+
+def extract_pages_from_pdf(pdf_path, dpi=None):
+    """Extract text per page from a PDF using PyMuPDF and Tesseract OCR, returns [(page_number, text)]."""
+    return extract_pages(pdf_path, dpi)
+
+def extract_text_from_pdf(pdf_path, dpi=None):
+    """Extract text from a PDF using PyMuPDF and Tesseract OCR."""
+    return "\n".join(text for _, text in extract_pages_from_pdf(pdf_path, dpi))
+
+def extract_text(file_path):
+    """Extract text from a supported document, returns an empty string for unknown types."""
+    return "\n".join(text for _, text in extract_pages(file_path))
@@ -0,0 +1,46 @@
+"""
+Chat prompts as Ollama chat messages, ordered so consecutive turns share a long prefix.
+
+Ollama keeps the KV cache of a loaded model's previous prompt and only evaluates what comes
+after the part a new prompt has in common with it. So the most stable parts come first: the
+constant system prompt, the session summary (changes only when turns are folded into it),
+the history turns (appended to and dropped in blocks, see history.build_history), and last
+the new message with the documents retrieved for it.
+"""
+from config import Config
+
+SYSTEM_PROMPT = (
+    "role: you are the official KZU-AI, the AI tutor/assistant of the kantonsschule zürcher unterland, "
+    "Your job is to help students/users in any way they needy you have an RAG built into you that will "
+    "supply you with data relevant to the context, it features old tests, presentations, homework, school "
+    "assignments etc. its sorted by subject and professor, use it to help students prepare for their exams "
+    "or anything else. Your only responsibility is to help students, nothing else, you will do their "
+    "homework, fill out their assignemtns etc. whenever they demand. language: whatever language user talks "
+    "to you in, dont speak any other language or translate to english automatically, only when asked."
+)
+
+def chat_messages(summary, history, user_message, context=""):
+    """Messages for ollama.chat(): history as built by build_history(), context goes with the new message."""
+    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}]
+    if summary:
+        messages.append({'role': 'system', 'content': f"Summary of the earlier conversation:\n{summary}"})
+    messages.extend(history)
+    if context:
+        user_message = f"Context from RAG:\n{context}\n\n{user_message}"
+    messages.append({'role': 'user', 'content': user_message})
+    return messages
+
+def is_standalone(messages):
+    """True if messages built by chat_messages() carry no earlier conversation (summary or history)."""
+    return len(messages) == 2
+
+def model_options():
+    """
+    Keyword arguments for every ollama.chat() call. All calls use the same context size, a
+    different num_ctx makes Ollama reload the model and lose its cache.
+    """
+    keep_alive = Config.CHAT_KEEP_ALIVE
+    options = {'keep_alive': int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive}
+    if Config.CHAT_NUM_CTX:
+        options['options'] = {'num_ctx': Config.CHAT_NUM_CTX}
+    return options
@@ -0,0 +1,205 @@
+"""
+Shared embedding and retrieval service for deployments with several web workers.
+
+One process holds the embedding model and the ChromaDB index; the web workers forward
+their RAG calls to it (see rag_utils.use_rag_service), so the model is loaded once and
+every worker searches the same index, uploads included. Queries arriving at the same
+time are encoded in one batch.
+
+    RAG_SERVICE_ADDRESS=/tmp/kzu-rag.sock RAG_SERVICE_AUTHKEY=<random secret> python rag_service.py
+
+Run it from the app directory and start the web workers with the same RAG_SERVICE_ADDRESS
+(a Unix socket path, a Windows pipe name or host:port) and RAG_SERVICE_AUTHKEY. Calls are
+pickled, so anyone holding the key can run code in the service: keep it secret.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+from config import Config
+
+DOCUMENTS_DIRECTORY = "RAG_scannable_documents"
+
+def parse_address(address):
+    """'host:port' becomes a TCP address, anything else is a Unix socket path or pipe name."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit() and not address.startswith(("/", "\\\\")):
+        return host, int(port)
+    return address
+
+# Shortest accepted RAG_SERVICE_AUTHKEY
+MIN_AUTHKEY_LENGTH = 16
+
+def authkey():
+    """The secret shared by the service and its clients, there is no default."""
+    key = Config.RAG_SERVICE_AUTHKEY
+    if not key or len(key) < MIN_AUTHKEY_LENGTH:
+        raise RuntimeError(
+            f"Set RAG_SERVICE_AUTHKEY to the same random secret (at least {MIN_AUTHKEY_LENGTH} characters) "
+            "for rag_service.py and the web workers"
+        )
+    return key.encode("utf-8")
+
+class QueryBatcher:
+    """
+    Collects query encodes from concurrent connections and runs them through the model together.
+    A batch waits at most max_wait seconds to fill up to max_batch queries.
+    """
+
+    def __init__(self, encode_batch, max_batch, max_wait):
+        self.encode_batch = encode_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        threading.Thread(target=self._run, name="query-batcher", daemon=True).start()
+
+    def encode(self, text):
+        future = Future()
+        self.pending.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.encode_batch([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+class ChangeLog:
+    """Numbered record of changed document paths, so workers can invalidate what they cached."""
+
+    def __init__(self, max_entries=10000):
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=max_entries)
+        self.sequence = 0
+
+    def record(self, path):
+        with self.lock:
+            self.sequence += 1
+            self.entries.append((self.sequence, path))
+
+    def since(self, sequence):
+        """Return (current sequence, paths changed after sequence)."""
+        with self.lock:
+            if sequence is None:
+                return self.sequence, []
+            return self.sequence, [path for number, path in self.entries if number > sequence]
+
+def serve(address):
+    import rag_utils
+
+    methods = {
+        "retrieve": rag_utils.retrieve,
+        "embed_query": rag_utils.embed_query,
+        "known_subjects": rag_utils.known_subjects,
+        "rag_status": rag_utils.rag_status,
+        "process_uploaded_file": rag_utils.process_uploaded_file,
+    }
+    changes = ChangeLog()
+    rag_utils.on_document_changed(changes.record)
+    batcher = QueryBatcher(
+        lambda texts: rag_utils.get_embedding_model().encode(texts, batch_size=len(texts)),
+        max_batch=Config.EMBED_BATCH_SIZE,
+        max_wait=Config.RAG_SERVICE_BATCH_WAIT_MS / 1000,
+    )
+    rag_utils.query_encoder = batcher.encode
+
+    def handle(connection):
+        with connection:
+            while True:
+                try:
+                    method, args, kwargs, seen = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ("ok", methods[method](*args, **kwargs))
+                except Exception as e:
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                connection.send(reply + changes.since(seen))
+
+    address = parse_address(address)
+    if isinstance(address, str) and os.name == "posix" and os.path.exists(address):
+        # Left over from a previous run
+        os.remove(address)
+    listener = Listener(address, authkey=authkey())
+    rag_utils.start_background_init(DOCUMENTS_DIRECTORY)
+    print(f"RAG service listening on {address}")
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, OSError) as e:
+            print(f"Rejected RAG service connection: {e}")
+            continue
+        threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+class RAGServiceUnavailable(RuntimeError):
+    """The service could not be reached, e.g. while it is (re)starting."""
+
+class RAGServiceClient:
+    """
+    Forwards calls to the RAG service, one connection per thread.
+    on_changes(paths) is called with documents the service re-indexed since the previous call.
+    """
+
+    def __init__(self, address, on_changes):
+        self.address = parse_address(address)
+        self.authkey = authkey()
+        self.on_changes = on_changes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Last change number seen, see ChangeLog
+        self.seen = None
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = Client(self.address, authkey=self.authkey)
+        return connection
+
+    def call(self, method, *args, **kwargs):
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send((method, args, kwargs, self.seen))
+                status, result, sequence, changed = connection.recv()
+                break
+            except (EOFError, OSError, AuthenticationError) as e:
+                # The service restarted, reconnect once
+                self.local.connection = None
+                if attempt:
+                    raise RAGServiceUnavailable(f"RAG service at {self.address} unreachable: {e}") from e
+        with self.lock:
+            # Also resets the count after a service restart
+            self.seen = sequence
+        if changed:
+            self.on_changes(changed)
+        if status == "error":
+            raise RuntimeError(f"RAG service: {result}")
+        return result
+
+if __name__ == '__main__':
+    if not Config.RAG_SERVICE_ADDRESS:
+        raise SystemExit("Set RAG_SERVICE_ADDRESS to the socket path or host:port to listen on")
+    try:
+        authkey()
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    serve(Config.RAG_SERVICE_ADDRESS)
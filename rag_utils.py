@@ -1,187 +1,696 @@
 import os
-from chromadb import Client
-from sentence_transformers import SentenceTransformer
-import pytesseract
-from PIL import Image
-import fitz  # PyMuPDF
-import tempfile
+import re
+import json
+import hashlib
+import threading
+import time
+from functools import lru_cache
 import shutil
-import datetime
+from config import Config
+from embedding_cache import EmbeddingCache
+from text_cache import TextCache
+from lexical_index import LexicalIndex
+from metrics import span, verbose
+from ocr_utils import (
+    IMAGE_EXTENSIONS,
+    extract_pages,
+    extract_pages_parallel,
+    extract_text,
+    extract_text_from_image,
+    extract_text_from_pdf,
+)
 
 # Global client variable for ChromaDB.
 client = None
 
-# Load a multilingual embedding model
-embedding_model = SentenceTransformer('distiluse-base-multilingual-cased-v1')
+# The index is persisted on disk; the manifest records (size, mtime, hash) of every
+# scanned file so a restart only has to extract and embed new or changed files. Files that
+# extracted to no text (blank scans, unsupported types) are kept with "empty": True so they
+# are not extracted again until they change; files whose extraction failed are left out.
+# Passages are stored once per distinct content (doc_hash), however many files share it.
+PERSIST_DIRECTORY = Config.CHROMA_PERSIST_DIRECTORY
+MANIFEST_PATH = os.path.join(PERSIST_DIRECTORY, "manifest.json")
+# Bump whenever the way documents are split or embedded changes, forces a full rebuild.
+MANIFEST_VERSION = 4
+manifest_lock = threading.Lock()
+# Callbacks interested in index changes, see on_document_changed()
+document_listeners = []
 
-# Configure Tesseract path for Windows
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+# Multilingual embedding model, loaded on first use (see get_embedding_model)
+EMBEDDING_MODEL_NAME = 'distiluse-base-multilingual-cased-v1'
+embedding_model = None
+embedding_model_lock = threading.Lock()
+embedding_cache = EmbeddingCache(os.path.join(PERSIST_DIRECTORY, "embeddings.sqlite3"))
+text_cache = TextCache(os.path.join(PERSIST_DIRECTORY, "extracted_text.sqlite3"))
+# Root of the scanned corpus, set by init_chromadb(); metadata is derived relative to it
+documents_root = "."
+# Keyword index over the same passages as the collection, see retrieve()
+lexical_index = LexicalIndex(os.path.join(PERSIST_DIRECTORY, "lexical_index.json"))
+# Cross-encoder for Config.RERANK_MODEL, loaded on first use
+reranker = None
+reranker_lock = threading.Lock()
 
-def extract_text_from_image(image_path):
-    """Extract text from an image using Tesseract OCR."""
+# Startup runs in the background: "starting" until the model and index are loaded, then
+# "syncing" while changed documents are (re)indexed, "ready" once done, or "failed".
+# rag_available is set as soon as queries can be answered.
+rag_state = "starting"
+rag_error = None
+rag_available = threading.Event()
+
+# Set by use_rag_service(): every RAG call is then forwarded to the shared rag_service.py process
+rag_service = None
+# Replaces the model call in embed_query(), rag_service.py uses it to batch concurrent queries
+query_encoder = None
+
+# Picks up documents added, edited or deleted while running, see start_document_watcher()
+document_watcher = None
+
+def get_embedding_model():
+    """Return the embedding model, loading it on first use."""
+    global embedding_model
+    with embedding_model_lock:
+        if embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return embedding_model
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_texts(texts):
+    """Embed texts in batches of EMBED_BATCH_SIZE, reusing cached vectors for text embedded before."""
+    hashes = [text_hash(text) for text in texts]
+    vectors = embedding_cache.get_many(EMBEDDING_MODEL_NAME, set(hashes))
+
+    # Encode every distinct uncached text once
+    missing = {}
+    for content_hash, text in zip(hashes, texts):
+        if content_hash not in vectors:
+            missing[content_hash] = text
+    missing_items = list(missing.items())
+    batch_size = Config.EMBED_BATCH_SIZE
+    for start in range(0, len(missing_items), batch_size):
+        batch = missing_items[start:start + batch_size]
+        encoded = get_embedding_model().encode([text for _, text in batch], batch_size=batch_size)
+        new_vectors = list(zip([content_hash for content_hash, _ in batch], encoded))
+        embedding_cache.put_many(EMBEDDING_MODEL_NAME, new_vectors)
+        vectors.update(new_vectors)
+
+    return [vectors[content_hash] for content_hash in hashes]
+
+@lru_cache(maxsize=Config.QUERY_EMBEDDING_CACHE_SIZE)
+def embed_query(prompt):
+    """Embed a query, recent prompts are served from memory. Callers must not modify the result."""
+    if rag_service is not None:
+        return rag_service.call("embed_query", prompt)
+    if query_encoder is not None:
+        return query_encoder(prompt)
+    return get_embedding_model().encode(prompt)
+
+def estimate_tokens(text):
+    """Rough token count, word pieces average about four thirds of a whitespace word."""
+    return len(text.split()) * 4 // 3
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text after roughly max_tokens tokens, keeping its formatting."""
+    max_words = max(1, max_tokens * 3 // 4)
+    for index, match in enumerate(re.finditer(r"\S+", text)):
+        if index == max_words:
+            return text[:match.start()].rstrip() + " …"
+    return text
+
+def chunk_pages(pages, chunk_tokens=None, overlap_tokens=None):
+    """
+    Split pages into overlapping passages that never cross a page boundary.
+    Returns a list of dicts with the passage text, its page and its character offset in the page.
+    """
+    chunk_tokens = chunk_tokens or Config.CHUNK_TOKENS
+    overlap_tokens = overlap_tokens if overlap_tokens is not None else Config.CHUNK_OVERLAP_TOKENS
+    # Work in words, the budgets above are in (estimated) model tokens
+    chunk_words = max(1, chunk_tokens * 3 // 4)
+    step = max(1, chunk_words - overlap_tokens * 3 // 4)
+
+    chunks = []
+    for page, text in pages:
+        words = [(m.start(), m.end()) for m in re.finditer(r"\S+", text)]
+        for start in range(0, len(words), step):
+            window = words[start:start + chunk_words]
+            chunks.append({
+                "text": text[window[0][0]:window[-1][1]],
+                "page": page,
+                "offset": window[0][0],
+            })
+            if start + chunk_words >= len(words):
+                break
+    return chunks
+
+# Document types recognised by keywords in folder and file names
+DOC_TYPE_KEYWORDS = [
+    ("test", ("test", "prüfung", "pruefung", "exam", "klausur")),
+    ("presentation", ("präsentation", "praesentation", "presentation", "folien", "slides")),
+    ("homework", ("hausaufgabe", "homework")),
+    ("worksheet", ("arbeitsblatt", "worksheet", "übung", "uebung", "exercise")),
+    ("summary", ("zusammenfassung", "summary", "lernziele")),
+]
+# Metadata keys retrieve() can filter on
+FILTER_KEYS = ("subject", "teacher", "doc_type")
+
+def document_metadata(file_path, documents_directory):
+    """
+    Derive passage metadata from where a file sits, the corpus is laid out as
+    Subjects/<Subject>/<Teacher>/... . Subject and teacher are lowercased for filtering.
+    """
+    metadata = {"path": file_path}
+    parts = os.path.relpath(file_path, documents_directory).split(os.sep)
+    # Files outside the corpus (e.g. uploads) carry no folder metadata
+    folders = parts[:-1] if parts[0] != os.pardir else []
+    if folders and folders[0].lower() == "subjects":
+        folders = folders[1:]
+    if folders:
+        metadata["subject"] = folders[0].lower()
+    if len(folders) > 1:
+        metadata["teacher"] = folders[1].lower()
+
+    words = re.split(r"[\W_]+", " ".join(folders[2:] + [os.path.splitext(parts[-1])[0]]).lower())
+    metadata["doc_type"] = "document"
+    for doc_type, keywords in DOC_TYPE_KEYWORDS:
+        if any(word.startswith(keyword) for word in words for keyword in keywords):
+            metadata["doc_type"] = doc_type
+            break
+    return metadata
+
+def clean_filters(filters):
+    """Keep the known, non-empty filters, lowercased. Returns None if nothing is left."""
+    if not isinstance(filters, dict):
+        return None
+    cleaned = {
+        key: value.strip().lower() for key, value in filters.items()
+        if key in FILTER_KEYS and isinstance(value, str) and value.strip()
+    }
+    return cleaned or None
+
+def known_subjects():
+    """Subjects present in the index."""
+    if rag_service is not None:
+        return rag_service.call("known_subjects")
+    return lexical_index.metadata_values("subject")
+
+def detect_filters(text):
+    """Guess a subject filter from free text such as a chat session's name, None while RAG is unavailable."""
+    if not rag_available.is_set():
+        return None
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image)
-        return text.strip()
-    except Exception as e:
-        print(f"Failed to extract text from image {image_path}: {e}")
-        return ""
+        subjects = known_subjects()
+    except (OSError, RuntimeError) as e:
+        print(f"Subject detection skipped: {e}")
+        return None
+    words = set(re.split(r"[\W_]+", text.lower()))
+    for subject in subjects:
+        if subject in words:
+            return {"subject": subject}
+    return None
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF using PyMuPDF and Tesseract OCR."""
+def file_hash(file_path):
+    """Return the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest():
+    """Load the manifest of indexed files keyed by path, empty if missing or from another index layout."""
     try:
-        text_parts = []
-        # Open PDF file
-        pdf_document = fitz.open(pdf_path)
-        
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            
-            # Try to get text directly first
-            text = page.get_text()
-            if text.strip():
-                text_parts.append(text.strip())
-            else:
-                # If no text found, try OCR on the page image
-                pix = page.get_pixmap()
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    img_path = f"{temp_dir}/page_{page_num}.png"
-                    pix.save(img_path)
-                    # Extract text using OCR
-                    ocr_text = extract_text_from_image(img_path)
-                    if ocr_text:
-                        text_parts.append(ocr_text)
-        
-        pdf_document.close()
-        return "\n".join(text_parts)
-    except Exception as e:
-        print(f"Failed to extract text from PDF {pdf_path}: {e}")
-        return ""
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data["files"]
 
-def init_chromadb(documents_directory):
-    global client
-    # Initialize ChromaDB client
-    client = Client()
+def save_manifest(manifest):
+    """Atomically write the manifest next to the persistent index."""
+    os.makedirs(PERSIST_DIRECTORY, exist_ok=True)
+    temp_path = MANIFEST_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": manifest}, f, indent=1)
+    os.replace(temp_path, MANIFEST_PATH)
+
+def get_collection():
+    if client is None:
+        raise Exception("ChromaDB not initialized. Call init_chromadb() first.")
+    return client.get_or_create_collection(name="documents")
+
+def on_document_changed(callback):
+    """Register callback(path), called whenever the passages stored for path are replaced or removed."""
+    document_listeners.append(callback)
+
+def notify_document_changed(path):
+    for callback in document_listeners:
+        try:
+            callback(path)
+        except Exception as e:
+            print(f"Document change listener failed for {path}: {e}")
+
+def index_document(collection, doc_hash, pages, metadata):
+    """Replace all passages stored for the content doc_hash with freshly chunked and embedded ones, returns the chunk count."""
+    remove_document(collection, doc_hash)
+    chunks = [chunk for chunk in chunk_pages(pages) if chunk["text"].strip()]
+    if not chunks:
+        return 0
+    # Generate multilingual embeddings for every passage
+    embeddings = embed_texts([chunk["text"] for chunk in chunks])
+    ids = [f"{doc_hash}#p{chunk['page']}:{chunk['offset']}" for chunk in chunks]
+    metadatas = [dict(metadata, doc_hash=doc_hash, page=chunk["page"], offset=chunk["offset"]) for chunk in chunks]
+    collection.add(
+        documents=[chunk["text"] for chunk in chunks],
+        embeddings=embeddings,
+        metadatas=metadatas,
+        ids=ids
+    )
+    for chunk_id, chunk, chunk_metadata in zip(ids, chunks, metadatas):
+        lexical_index.add(chunk_id, chunk["text"], chunk_metadata)
+    return len(chunks)
+
+def indexed_path(collection, doc_hash):
+    """The path the passages of doc_hash are currently filed under, None if it has none."""
+    stored = collection.get(where={"doc_hash": doc_hash}, limit=1, include=["metadatas"])
+    return stored["metadatas"][0]["path"] if stored["ids"] else None
 
-    # Get or create a collection
+def remove_document(collection, doc_hash):
+    """Drop every passage of the content doc_hash from the vector and the keyword index."""
+    path = indexed_path(collection, doc_hash)
+    if path is None:
+        return
+    collection.delete(where={"doc_hash": doc_hash})
+    lexical_index.remove_document(doc_hash)
+    notify_document_changed(path)
+
+def canonical_path(paths):
+    """
+    Of several files with the same content, the one its passages are filed under:
+    the one with the most specific metadata (subject, teacher), then the first by name.
+    """
+    return min(paths, key=lambda path: (-len(document_metadata(path, documents_root)), path))
+
+def refresh_document(collection, manifest, doc_hash, pages=None):
+    """
+    Bring the passages of doc_hash in line with the manifest after files with that content were
+    added or removed: dropped once no file has it, (re)indexed under the canonical path otherwise.
+    pages default to the cached extracted text. Returns the number of chunks indexed.
+    """
+    paths = [path for path, entry in manifest.items() if entry["hash"] == doc_hash and not entry.get("empty")]
+    if not paths:
+        remove_document(collection, doc_hash)
+        return 0
+    path = canonical_path(paths)
+    if indexed_path(collection, doc_hash) == path:
+        return 0
+    pages = pages or text_cache.get(doc_hash)
+    if not pages:
+        raise ValueError(f"No extracted text for {path}")
+    return index_document(collection, doc_hash, pages, document_metadata(path, documents_root))
+
+def rebuild_lexical_index(collection):
+    """Fill the keyword index from the passages already stored in the collection."""
+    lexical_index.clear()
+    stored = collection.get(include=["documents", "metadatas"])
+    for chunk_id, document, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+        lexical_index.add(chunk_id, document, metadata)
+
+def init_chromadb(documents_directory):
+    global client, rag_state, documents_root
+    documents_root = documents_directory
+    from chromadb import PersistentClient
+    # Open (or create) the persistent ChromaDB index
+    client = PersistentClient(path=PERSIST_DIRECTORY)
     collection = client.get_or_create_collection(name="documents")
 
+    with manifest_lock:
+        manifest = load_manifest()
+        if not manifest and collection.count():
+            # Index built by an older layout, rebuild it from scratch
+            client.delete_collection(name="documents")
+            collection = client.get_or_create_collection(name="documents")
+            lexical_index.clear()
+        elif collection.count() == 0:
+            # The index was wiped, the manifest can no longer be trusted
+            manifest = {}
+            lexical_index.clear()
+        elif not lexical_index.load():
+            # Index built before keyword search existed
+            rebuild_lexical_index(collection)
+        # Queries can use what is indexed already while changed files are processed
+        rag_state = "syncing"
+        rag_available.set()
+        try:
+            added, unchanged, removed = sync_directory(collection, manifest, documents_directory)
+        finally:
+            save_manifest(manifest)
+            lexical_index.save()
+
+    rag_state = "ready"
+    print(f"ChromaDB ready: {added} indexed, {unchanged} unchanged, {removed} removed")
+
+def start_background_init(documents_directory):
+    """Load the embedding model and bring the index up to date on a background thread."""
+    def run():
+        global rag_state, rag_error
+        try:
+            get_embedding_model()
+            init_chromadb(documents_directory)
+        except Exception as e:
+            rag_state, rag_error = "failed", str(e)
+            print(f"RAG initialisation failed: {e}")
+            return
+        if Config.WATCH_DOCUMENTS:
+            start_document_watcher(documents_directory)
+
+    thread = threading.Thread(target=run, name="rag-init", daemon=True)
+    thread.start()
+    return thread
+
+def sync_documents():
+    """Index files added or changed in the documents directory since the last sync and drop removed ones."""
+    with manifest_lock:
+        manifest = load_manifest()
+        try:
+            added, unchanged, removed = sync_directory(get_collection(), manifest, documents_root)
+        finally:
+            save_manifest(manifest)
+            lexical_index.save()
+    if added or removed:
+        print(f"Documents synced: {added} indexed, {removed} removed")
+
+def start_document_watcher(documents_directory):
+    """Keep the index in step with the documents directory while running, see watcher.py."""
+    global document_watcher
+    from watcher import DocumentWatcher
+    document_watcher = DocumentWatcher(
+        documents_directory,
+        sync_documents,
+        debounce=Config.WATCH_DEBOUNCE_SECONDS,
+        poll_interval=Config.WATCH_POLL_INTERVAL
+    ).start()
+    return document_watcher
+
+def use_rag_service(address):
+    """
+    Forward all RAG calls to the rag_service.py process at address instead of loading the
+    model and index here. Documents the service re-indexes are announced to local listeners.
+    """
+    global rag_service
+    from rag_service import RAGServiceClient
+
+    def announce(paths):
+        for path in paths:
+            notify_document_changed(path)
+
+    rag_service = RAGServiceClient(address, announce)
+
+    def wait_for_service():
+        while True:
+            try:
+                if rag_service.call("rag_status")["available"]:
+                    rag_available.set()
+                    return
+            except Exception as e:
+                print(f"Waiting for the RAG service at {address}: {e}")
+            time.sleep(1)
+
+    threading.Thread(target=wait_for_service, name="rag-service-wait", daemon=True).start()
+
+def rag_status():
+    """Readiness of the RAG system: {"state", "available", "error"}."""
+    if rag_service is not None:
+        try:
+            return rag_service.call("rag_status")
+        except Exception as e:
+            return {"state": "unreachable", "available": False, "error": str(e)}
+    return {"state": rag_state, "available": rag_available.is_set(), "error": rag_error}
+
+def sync_directory(collection, manifest, documents_directory):
+    """Bring the collection in line with the files on disk, returns (added, unchanged, removed)."""
+    unchanged = 0
+    changed = {}
     # Walk through the documents directory, including subfolders
     for root, _, files in os.walk(documents_directory):
         for file in files:
-            file_path = os.path.join(root, file)
+            file_path = os.path.normpath(os.path.join(root, file))
             try:
-                content = ""
-                # Handle different file types
-                if file.lower().endswith(('.txt')):
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                elif file.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
-                    content = extract_text_from_image(file_path)
-                elif file.lower().endswith('.pdf'):
-                    content = extract_text_from_pdf(file_path)
-                
-                if content.strip():  # Only process if we have extracted content
-                    # Generate multilingual embeddings for the document
-                    embedding = embedding_model.encode(content)
-                    # Add the document to the collection with its embedding
-                    collection.add(
-                        documents=[content],
-                        embeddings=[embedding],
-                        metadatas=[{"path": file_path}],
-                        ids=[file_path]  # Use the file path as a unique ID
-                    )
-                    print(f"Document added: {file_path}")  # Debug statement
+                stat = os.stat(file_path)
+                entry = manifest.get(file_path)
+                if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                    unchanged += 1
+                    continue
+
+                digest = file_hash(file_path)
+                if entry and entry["hash"] == digest:
+                    # Touched but not modified, only refresh the stat fields
+                    entry.update(size=stat.st_size, mtime=stat.st_mtime)
+                    unchanged += 1
+                    continue
+                changed[file_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest}
             except Exception as e:
                 print(f"Failed to load {file_path}: {e}")
 
-def query_context(prompt: str, n_results: int = 5, similarity_threshold: float = 1.5) -> str:
-    if client is None:
-        raise Exception("ChromaDB not initialized. Call init_chromadb() first.")
-    
-    # Get or create a collection
-    collection = client.get_or_create_collection(name="documents")
+    # Contents whose passages may have to change: new, modified away from, or removed
+    affected = {entry["hash"] for entry in changed.values()}
+    for file_path in changed:
+        if file_path in manifest:
+            affected.add(manifest[file_path]["hash"])
+    removed = [path for path in manifest if not os.path.exists(path)]
+    for path in removed:
+        affected.add(manifest.pop(path)["hash"])
+    manifest.update(changed)
+
+    # Only content never extracted before goes through OCR, once per distinct hash, on the process pool
+    empty = {entry["hash"] for entry in manifest.values() if entry.get("empty")}
+    to_extract = {}
+    for file_path, entry in changed.items():
+        if entry["hash"] in empty:
+            entry["empty"] = True
+        elif entry["hash"] not in to_extract.values() and not text_cache.get(entry["hash"]):
+            to_extract[file_path] = entry["hash"]
+    for file_path, pages in extract_pages_parallel(list(to_extract)):
+        same_content = [path for path, entry in changed.items() if entry["hash"] == to_extract[file_path]]
+        if pages is None:
+            # Extraction failed, left out of the manifest so it is retried on the next sync
+            for path in same_content:
+                del manifest[path]
+        elif not pages:
+            # No text or an unsupported type, remembered so it isn't extracted again until it changes
+            for path in same_content:
+                manifest[path]["empty"] = True
+        else:
+            text_cache.put(to_extract[file_path], pages)
+
+    added = 0
+    for doc_hash in affected:
+        try:
+            chunk_count = refresh_document(collection, manifest, doc_hash)
+            if chunk_count:
+                added += 1
+                print(f"Document added: {indexed_path(collection, doc_hash)} ({chunk_count} chunks)")  # Debug statement
+        except Exception as e:
+            print(f"Failed to index {doc_hash}: {e}")
+            # Retried on the next sync
+            for path in [path for path, entry in changed.items() if entry["hash"] == doc_hash]:
+                manifest.pop(path, None)
+    return added, unchanged, len(removed)
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """Merge ranked id lists into one, ids ranked high in several lists come first."""
+    k = k or Config.RETRIEVAL_RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def get_reranker():
+    global reranker
+    with reranker_lock:
+        if reranker is None:
+            from sentence_transformers import CrossEncoder
+            reranker = CrossEncoder(Config.RERANK_MODEL, device=Config.RERANK_DEVICE)
+    return reranker
+
+def rerank(prompt, passages):
+    """
+    Order the leading passages by cross-encoder relevance to the prompt.
+    Scores small batches until RERANK_TIME_BUDGET_MS is spent, the rest keep their fused order.
+    """
+    model = get_reranker()
+    deadline = time.monotonic() + Config.RERANK_TIME_BUDGET_MS / 1000
+    candidates = passages[:Config.RERANK_CANDIDATES]
+    scored = []
+    batch_size = 4
+    for start in range(0, len(candidates), batch_size):
+        if scored and time.monotonic() > deadline:
+            break
+        batch = candidates[start:start + batch_size]
+        scores = model.predict([(prompt, passage["text"]) for passage in batch])
+        scored.extend(zip(scores, batch))
+    reranked = [passage for _, passage in sorted(scored, key=lambda item: item[0], reverse=True)]
+    return reranked + passages[len(scored):]
+
+def make_passage(doc_id, text, metadata, distance):
+    return {
+        "id": doc_id,
+        "text": text,
+        "path": metadata.get("path", ""),
+        "page": metadata.get("page", 1),
+        "distance": distance,
+    }
+
+def retrieve(prompt: str, n_results: int = 5, similarity_threshold: float = 1.5, max_tokens: int = None, filters: dict = None) -> list:
+    """
+    Return the best matching passages, most relevant first, within a prompt token budget.
+    Vector hits within similarity_threshold and keyword (BM25) hits are merged with
+    reciprocal-rank fusion and optionally reranked by a cross-encoder.
+    filters (subject, teacher, doc_type) restrict the search to matching documents.
+    Each passage is a dict with id, text, path, page and distance (None for keyword-only hits).
+    """
+    if rag_service is not None:
+        return rag_service.call("retrieve", prompt, n_results, similarity_threshold, max_tokens, filters)
+    collection = get_collection()
+    max_tokens = max_tokens or Config.CONTEXT_TOKEN_BUDGET
+    candidate_count = max(n_results, Config.RETRIEVAL_CANDIDATES)
+    filters = clean_filters(filters)
+    where = None
+    if filters:
+        conditions = [{key: value} for key, value in filters.items()]
+        where = conditions[0] if len(conditions) == 1 else {"$and": conditions}
 
     # Generate multilingual embeddings for the prompt
-    prompt_embedding = embedding_model.encode(prompt)
+    with span("query_embedding"):
+        prompt_embedding = embed_query(prompt)
 
     # Perform the query using the prompt embedding
-    results = collection.query(
-        query_embeddings=[prompt_embedding],
-        n_results=n_results
-    )
+    with span("vector_search"):
+        results = collection.query(
+            query_embeddings=[prompt_embedding],
+            n_results=candidate_count,
+            where=where
+        )
+
+    # Vector candidates within the distance threshold (lower is better)
+    found = {}
+    vector_ranking = []
+    if results and results.get("ids") and results["ids"][0]:
+        for doc_id, doc, meta, distance in zip(results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]):
+            if distance > similarity_threshold:
+                continue
+            found[doc_id] = make_passage(doc_id, doc, meta, distance)
+            vector_ranking.append(doc_id)
+
+    # Keyword candidates catch exact names, symbols and codes the embedding blurs
+    with span("keyword_search"):
+        keyword_ranking = [doc_id for doc_id, _ in lexical_index.search(prompt, candidate_count, where=filters)]
+        missing = [doc_id for doc_id in keyword_ranking if doc_id not in found]
+        if missing:
+            stored = collection.get(ids=missing, include=["documents", "metadatas"])
+            for doc_id, doc, meta in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                found[doc_id] = make_passage(doc_id, doc, meta, None)
 
-    # Extract documents and distances
-    if results and "documents" in results and results["documents"]:
-        documents = results["documents"][0]
-        distances = results.get("distances", [[]])[0]  # Get distances for the first query
+    ranked = [found[doc_id] for doc_id in reciprocal_rank_fusion([vector_ranking, keyword_ranking]) if doc_id in found]
+    if Config.RERANK_MODEL and len(ranked) > 1:
+        try:
+            with span("rerank"):
+                ranked = rerank(prompt, ranked)
+        except Exception as e:
+            print(f"Reranking failed, using fused order: {e}")
 
-        # Log the distances for debugging
-        print("Query Results (Distances):", list(zip(documents, distances)))  # Debug statement
+    # Log the merged ranking for debugging (sampled, see PROMPT_LOG_SAMPLE_RATE)
+    if verbose():
+        print("Query Results (path, page, distance):", [(passage["path"], passage["page"], passage["distance"]) for passage in ranked[:n_results]])  # Debug statement
 
-        # Filter documents based on the distance threshold (lower is better)
-        filtered_documents = [
-            doc for doc, distance in zip(documents, distances) if distance <= similarity_threshold
-        ]
+    # Keep the best passages until the budget is used up
+    passages = []
+    used_tokens = 0
+    for passage in ranked[:n_results]:
+        tokens = estimate_tokens(passage["text"])
+        if used_tokens + tokens > max_tokens:
+            break
+        passages.append(passage)
+        used_tokens += tokens
+    return passages
 
-        # Return the filtered context as a single string
-        if filtered_documents:
-            return "\n".join(filtered_documents)
-    
-    return ""  # Return an empty string if no documents meet the threshold
+def format_context(passages) -> str:
+    """Render retrieved passages for the prompt, each labelled with its source."""
+    return "\n\n".join(
+        f"[{os.path.basename(passage['path'])}, p. {passage['page']}]\n{passage['text']}" for passage in passages
+    )
+
+def query_context(prompt: str, n_results: int = 5, similarity_threshold: float = 1.5, max_tokens: int = None, filters: dict = None) -> str:
+    """Return the best matching passages as a single string, empty if none meet the threshold."""
+    return format_context(retrieve(prompt, n_results, similarity_threshold, max_tokens, filters))
 
-def process_uploaded_file(file_path: str, destination_dir: str = "RAG_SCANNABLE_DOCUMENTS") -> tuple[str, str]:
+def process_uploaded_file(file_path: str, destination_dir: str = "RAG_SCANNABLE_DOCUMENTS", progress_callback=None) -> tuple[str, str]:
     """
     Process an uploaded file and add it to both the conversation context and RAG system.
+    progress_callback(fraction, message) is called as the processing moves through its stages.
     Returns a tuple of (extracted_text, destination_path).
     """
+    progress = progress_callback or (lambda fraction, message=None: None)
+    if rag_service is not None:
+        # The service may run in another directory, hand it an absolute path
+        progress(0.1, "Extracting text and indexing")
+        return tuple(rag_service.call("process_uploaded_file", os.path.abspath(file_path), destination_dir))
+    # Uploads are stored under their content hash, so the same content is only kept and indexed once
+    if not file_path.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',)):
+        raise ValueError("Unsupported file type")
+    digest = file_hash(file_path)
+    base_name, ext = os.path.splitext(os.path.basename(file_path))
+    destination_path = os.path.normpath(os.path.join(destination_dir, f"{base_name}_{digest[:16]}{ext}"))
+    copied = False
     try:
+        with manifest_lock:
+            existing = [path for path, entry in load_manifest().items() if entry["hash"] == digest and os.path.exists(path)]
+        pages = text_cache.get(digest)
+        if existing and pages:
+            # Same content is already indexed, nothing to extract or embed
+            print(f"Upload {file_path} is a duplicate of {existing[0]}")
+            return "\n".join(text for _, text in pages), existing[0]
+
         # Create destination directory if it doesn't exist
         os.makedirs(destination_dir, exist_ok=True)
-        
-        # Generate unique filename using timestamp
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = os.path.basename(file_path)
-        base_name, ext = os.path.splitext(file_name)
-        unique_name = f"{base_name}_{timestamp}{ext}"
-        destination_path = os.path.join(destination_dir, unique_name)
-        
-        # Copy file to destination
-        shutil.copy2(file_path, destination_path)
-        
-        # Extract text based on file type
-        content = ""
-        if file_path.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
-            content = extract_text_from_image(destination_path)
-        elif file_path.lower().endswith('.pdf'):
-            content = extract_text_from_pdf(destination_path)
-        else:
-            raise ValueError("Unsupported file type")
-            
+        if not os.path.exists(destination_path):
+            shutil.copy2(file_path, destination_path)
+            copied = True
+
+        # Reuse text extracted from the same content earlier, OCR only new content
+        if not pages:
+            progress(0.1, "Extracting text")
+            pages = extract_pages(destination_path)
+        content = "\n".join(text for _, text in pages)
+
         if not content.strip():
             raise ValueError("No text could be extracted from the file")
-            
+        text_cache.put(digest, pages)
+
         # Add to ChromaDB
+        progress(0.7, "Adding to the knowledge base")
         if client is None:
             init_chromadb(destination_dir)
-            
-        collection = client.get_or_create_collection(name="documents")
-        embedding = embedding_model.encode(content)
-        
-        # Add the document to ChromaDB
-        collection.add(
-            documents=[content],
-            embeddings=[embedding],
-            metadatas=[{"path": destination_path, "filename": unique_name}],
-            ids=[destination_path]
-        )
-        
+
+        # Record the upload so the next startup does not index it again
+        stat = os.stat(destination_path)
+        with manifest_lock:
+            manifest = load_manifest()
+            manifest[destination_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest}
+            refresh_document(get_collection(), manifest, digest, pages)
+            save_manifest(manifest)
+            lexical_index.save()
+
         print(f"File processed and added to RAG: {destination_path}")
         return content, destination_path
-        
+
     except Exception as e:
         print(f"Failed to process uploaded file {file_path}: {e}")
         # Clean up if file was copied but processing failed
-        if 'destination_path' in locals() and os.path.exists(destination_path):
+        if copied and os.path.exists(destination_path):
             os.remove(destination_path)
         raise
@@ -0,0 +1,83 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+class ResponseCache:
+    """
+    Semantic cache of finished answers.
+    An entry matches a new question when both retrieved the same passages and their
+    embeddings are at least similarity_threshold cosine-similar. Entries expire after
+    ttl_seconds, the least recently used ones are evicted beyond max_entries, and
+    invalidate_path() drops every answer built on a document that was re-indexed.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, similarity_threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        # entry_id -> entry, least recently used first
+        self.entries = OrderedDict()
+        # context key -> entry_ids, so a lookup only compares against answers from the same passages
+        self.by_context = {}
+
+    @staticmethod
+    def _context_key(context_ids):
+        return tuple(sorted(context_ids))
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, context_ids):
+        """Return the cached answer for a similar question over the same passages, or None."""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self.lock:
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id in list(self.by_context.get(self._context_key(context_ids), ())):
+                entry = self.entries[entry_id]
+                if now - entry["created"] > self.ttl_seconds:
+                    self._drop(entry_id)
+                    continue
+                score = float(np.dot(query, entry["embedding"]))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                return None
+            self.entries.move_to_end(best_id)
+            return self.entries[best_id]["response"]
+
+    def store(self, embedding, context_ids, paths, response):
+        """Remember an answer; paths are the documents the retrieved passages came from."""
+        context_key = self._context_key(context_ids)
+        with self.lock:
+            entry_id = next(self.ids)
+            self.entries[entry_id] = {
+                "embedding": self._normalize(embedding),
+                "context": context_key,
+                "paths": set(paths),
+                "response": response,
+                "created": time.time(),
+            }
+            self.by_context.setdefault(context_key, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate_path(self, path):
+        """Forget every answer that used passages of path."""
+        with self.lock:
+            for entry_id in [entry_id for entry_id, entry in self.entries.items() if path in entry["paths"]]:
+                self._drop(entry_id)
+
+    def _drop(self, entry_id):
+        entry = self.entries.pop(entry_id)
+        siblings = self.by_context[entry["context"]]
+        siblings.discard(entry_id)
+        if not siblings:
+            del self.by_context[entry["context"]]
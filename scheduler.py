@@ -0,0 +1,172 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+# Status lines sent in front of a streamed answer start with this character; the
+# chat UI strips them and shows the queue position instead.
+STATUS_PREFIX = "\x1e"
+
+def format_queue_status(position):
+    return f"{STATUS_PREFIX}{json.dumps({'queue_position': position})}\n"
+
+class Ticket:
+    """A request's place in the scheduler. Wait for granted, watch cancelled while generating."""
+
+    def __init__(self, user_id, session_id, background=False):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.background = background
+        self.submitted = time.monotonic()
+        self.granted = threading.Event()
+        self.cancelled = threading.Event()
+        self._changed = threading.Event()
+        # (loop, asyncio.Event) of coroutines in wait_async()
+        self._async_waiters = []
+
+    def wait(self, timeout=None):
+        """Block until the ticket is granted or cancelled, returns False on timeout."""
+        self._changed.wait(timeout)
+        return self.granted.is_set() or self.cancelled.is_set()
+
+    async def wait_async(self, timeout=None):
+        """wait() for asyncio code: the scheduler wakes the coroutine, no thread is tied up."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        self._async_waiters.append(waiter)
+        try:
+            # Checked after registering, so a grant in between is not missed
+            if not self.ready:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._async_waiters.remove(waiter)
+        return self.ready
+
+    def _notify(self):
+        self._changed.set()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    @property
+    def ready(self):
+        return self.granted.is_set() or self.cancelled.is_set()
+
+class LLMScheduler:
+    """
+    Admission control in front of the model: at most max_concurrent generations run at once,
+    waiting requests are served round-robin across users so one busy user can't starve the
+    others, and a new request in a session cancels that session's earlier one. Background
+    work (session summaries) shares the slots and starts while no user is waiting, or at
+    the next free slot once it has waited background_max_wait seconds, so it can't starve.
+    The limit applies per process.
+    """
+
+    def __init__(self, max_concurrent, background_max_wait=30.0):
+        self.max_concurrent = max_concurrent
+        self.background_max_wait = background_max_wait
+        self.lock = threading.Lock()
+        # user_id -> queued tickets, in order of arrival
+        self.queues = {}
+        self.active = set()
+        # user_id -> sequence number of the user's last granted request, the lowest goes next
+        self.last_served = {}
+        self.served = 0
+        # (user_id, session_id) -> the session's latest ticket
+        self.latest = {}
+        self.background = deque()
+        # ticket -> queue position, computed on demand and dropped whenever the queues change
+        self.positions = None
+
+    def submit(self, user_id, session_id):
+        ticket = Ticket(user_id, session_id)
+        with self.lock:
+            previous = self.latest.get((user_id, session_id))
+            if previous is not None:
+                self._cancel(previous)
+            self.latest[(user_id, session_id)] = ticket
+            self.queues.setdefault(user_id, deque()).append(ticket)
+            self._dispatch()
+            self.positions = None
+        return ticket
+
+    def submit_background(self, session_id):
+        """Queue low-priority work; it never cancels or delays a user's request."""
+        ticket = Ticket(None, session_id, background=True)
+        with self.lock:
+            self.background.append(ticket)
+            self._dispatch()
+        return ticket
+
+    def release(self, ticket):
+        """Give the slot back (or leave the queue). Call exactly once per ticket."""
+        with self.lock:
+            self.active.discard(ticket)
+            self._remove_queued(ticket)
+            if self.latest.get((ticket.user_id, ticket.session_id)) is ticket:
+                del self.latest[(ticket.user_id, ticket.session_id)]
+            if ticket.user_id not in self.queues and not any(t.user_id == ticket.user_id for t in self.active):
+                # Idle users start over
+                self.last_served.pop(ticket.user_id, None)
+            self._dispatch()
+            self.positions = None
+
+    def position(self, ticket):
+        """1-based place in the line, 0 once the ticket is no longer waiting."""
+        with self.lock:
+            if self.positions is None:
+                # One replay of the round-robin order serves every waiting client until the next change
+                self.positions = {}
+                queues = [self.queues[user_id] for user_id in self._user_order()]
+                for round_index in range(max((len(queue) for queue in queues), default=0)):
+                    for queue in queues:
+                        if len(queue) > round_index:
+                            self.positions[queue[round_index]] = len(self.positions) + 1
+            return self.positions.get(ticket, 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "active": len(self.active),
+                "queued": sum(len(queue) for queue in self.queues.values()),
+                "background": len(self.background),
+                "max_concurrent": self.max_concurrent,
+            }
+
+    def _cancel(self, ticket):
+        ticket.cancelled.set()
+        ticket._notify()
+        self._remove_queued(ticket)
+
+    def _remove_queued(self, ticket):
+        if ticket.background:
+            if ticket in self.background:
+                self.background.remove(ticket)
+            return
+        queue = self.queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.user_id]
+
+    def _user_order(self):
+        """Waiting users in serving order: least recently served first, then by arrival."""
+        return sorted(self.queues, key=lambda user_id: self.last_served.get(user_id, -1))
+
+    def _dispatch(self):
+        while len(self.active) < self.max_concurrent and (self.queues or self.background):
+            overdue = self.background and time.monotonic() - self.background[0].submitted >= self.background_max_wait
+            if self.queues and not overdue:
+                user_id = self._user_order()[0]
+                queue = self.queues[user_id]
+                ticket = queue.popleft()
+                if not queue:
+                    del self.queues[user_id]
+                self.served += 1
+                self.last_served[user_id] = self.served
+            else:
+                ticket = self.background.popleft()
+            self.active.add(ticket)
+            ticket.granted.set()
+            ticket._notify()
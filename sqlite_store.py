@@ -0,0 +1,20 @@
+import os
+import sqlite3
+import threading
+
+class SQLiteStore:
+    """
+    Base of the small SQLite stores (embedding cache, text cache, upload store): one connection
+    shared by all threads behind self.lock, in WAL mode so other processes can read meanwhile.
+    Subclasses list their CREATE TABLE statements in SCHEMA.
+    """
+    SCHEMA = ()
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
@@ -27,26 +27,62 @@ document.addEventListener('DOMContentLoaded', () => {
   // Initial history load
   loadChatHistory(window.currentSessionId);
 
+  // Lazy loading of older messages
+  document.getElementById('chat-window').addEventListener('scroll', (event) => {
+    if (event.target.scrollTop < 100) loadOlderMessages();
+  });
+
   // Form submission
   document.getElementById('chat-form').addEventListener('submit', handleChatSubmit);
 });
 
 // Function to load chat history
-// This function fetches the chat history from the server using Fetch API 
+// This function fetches the newest page of the chat history from the server using Fetch API
+// Older messages are loaded page by page when the user scrolls to the top
+const HISTORY_PAGE_SIZE = 50;
+let historyCursor = null;
+let historyLoading = false;
+
 function loadChatHistory(sessionId) {
-  fetch(`/chat_history/${sessionId}`)
+  historyCursor = null;
+  fetch(`/chat_history/${sessionId}?limit=${HISTORY_PAGE_SIZE}`)
     .then(response => response.json())
-    .then(history => {
+    .then(page => {
+      if (sessionId !== window.currentSessionId) return;
       const chatWindow = document.getElementById('chat-window');
       chatWindow.innerHTML = "";
-      history.forEach(msg => {
+      page.messages.forEach(msg => {
         appendMessage(msg.content, !msg.is_user);
       });
+      historyCursor = page.next_before_id;
       chatWindow.scrollTop = chatWindow.scrollHeight;
     })
     .catch(error => console.error('Error loading chat history:', error));
 }
 
+// Function to load the page of messages before the oldest one shown
+function loadOlderMessages() {
+  if (!historyCursor || historyLoading) return;
+  historyLoading = true;
+  const sessionId = window.currentSessionId;
+  fetch(`/chat_history/${sessionId}?limit=${HISTORY_PAGE_SIZE}&before_id=${historyCursor}`)
+    .then(response => response.json())
+    .then(page => {
+      if (sessionId !== window.currentSessionId) return;
+      const chatWindow = document.getElementById('chat-window');
+      // Keep the visible messages in place while older ones are inserted above them
+      const distanceFromBottom = chatWindow.scrollHeight - chatWindow.scrollTop;
+      const firstMessage = chatWindow.firstChild;
+      page.messages.forEach(msg => {
+        chatWindow.insertBefore(createMessageElement(msg.content, !msg.is_user), firstMessage);
+      });
+      chatWindow.scrollTop = chatWindow.scrollHeight - distanceFromBottom;
+      historyCursor = page.next_before_id;
+    })
+    .catch(error => console.error('Error loading chat history:', error))
+    .finally(() => { historyLoading = false; });
+}
+
 // Function to handle chat form submission
 // This function prevents the default form submission, retrieves the message input, 
 // and sends the message to the server using Fetch API
@@ -86,27 +122,46 @@ function handleChatSubmit(event) {
 function streamBotResponse(body) {
   const reader = body.getReader();
   const decoder = new TextDecoder();
-  let botMessage = "";
+  let received = "";
 
   function read() {
     reader.read().then(({ done, value }) => {
+      received += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const { text, status } = splitStatusLines(received);
       if (done) {
-        finalizeBotMessage(botMessage);
+        finalizeBotMessage(text);
         return;
       }
-      
-      botMessage += decoder.decode(value, { stream: true });
-      updateTempBotMessage(botMessage);
+
+      if (!text && status && status.queue_position) {
+        updateTempBotMessage(`*Waiting in line, position ${status.queue_position}…*`);
+      } else {
+        updateTempBotMessage(text);
+      }
       read();
     });
   }
   read();
 }
 
-// Function to append a message to the chat window
-// This function creates a new message element and appends it to the chat window  
-function appendMessage(text, isBot) {
-  const chatWindow = document.getElementById('chat-window');
+// Function to separate server status lines from the answer
+// Status lines start with the ASCII record separator and carry JSON (e.g. the queue position)
+function splitStatusLines(raw) {
+  let status = null;
+  const text = raw.replace(/\x1e([^\n]*)\n/g, (match, payload) => {
+    try {
+      status = JSON.parse(payload);
+    } catch (error) {
+      console.error('Invalid status line:', payload);
+    }
+    return '';
+  }).replace(/\x1e[^\n]*$/, '');  // a status line that is still arriving
+  return { text, status };
+}
+
+// Function to create a message element
+// This function renders a message (markdown for the bot) into a new element
+function createMessageElement(text, isBot) {
   const messageDiv = document.createElement('div');
   messageDiv.className = `message ${isBot ? 'bot' : 'user'}`;
   
@@ -119,14 +174,20 @@ function appendMessage(text, isBot) {
     <div class="message-time">${new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })}</div>
   `;
 
-  chatWindow.appendChild(messageDiv);
-  chatWindow.scrollTop = chatWindow.scrollHeight;
-
   if (isBot) {
     messageDiv.querySelectorAll('pre code').forEach(block => {
       hljs.highlightElement(block);
     });
   }
+  return messageDiv;
+}
+
+// Function to append a message to the chat window
+// This function creates a new message element and appends it to the chat window  
+function appendMessage(text, isBot) {
+  const chatWindow = document.getElementById('chat-window');
+  chatWindow.appendChild(createMessageElement(text, isBot));
+  chatWindow.scrollTop = chatWindow.scrollHeight;
 }
 
 // Function to update the temporary bot message
@@ -198,7 +259,15 @@ document.getElementById('file-upload').addEventListener('change', async (event)
 
         const result = await response.json();
 
-        if (response.ok) {
+        if (!response.ok) {
+            console.error('Upload failed:', result.error);
+            return;
+        }
+
+        // Processing runs in the background, poll its status until it finishes
+        const job = await waitForUploadJob(result.status_url, overlay);
+
+        if (job.state === 'done') {
             // Show a small notification that file is ready to be sent
             const notification = document.createElement('div');
             notification.className = 'upload-notification';
@@ -208,7 +277,7 @@ document.getElementById('file-upload').addEventListener('change', async (event)
             // Remove notification after 2 seconds
             setTimeout(() => notification.remove(), 2000);
         } else {
-            console.error('Upload failed:', result.error);
+            console.error('Upload failed:', job.error);
         }
     } catch (error) {
         console.error('Upload error:', error);
@@ -218,4 +287,28 @@ document.getElementById('file-upload').addEventListener('change', async (event)
         // Clear file input
         event.target.value = '';
     }
-});
\ No newline at end of file
+});
+
+// Function to poll an upload job
+// This function checks the job status once a second, mirrors its progress in the overlay
+// and resolves with the final job once it is done or failed
+async function waitForUploadJob(statusUrl, overlay) {
+    const label = overlay.querySelector('.upload-progress div');
+    const fill = overlay.querySelector('.progress-bar-fill');
+
+    while (true) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!response.ok) {
+            return { state: 'failed', error: job.error };
+        }
+
+        fill.style.width = `${Math.round(job.progress * 100)}%`;
+        if (job.message) label.textContent = job.message;
+
+        if (job.state === 'done' || job.state === 'failed') {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
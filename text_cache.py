@@ -0,0 +1,23 @@
+import json
+from sqlite_store import SQLiteStore
+
+class TextCache(SQLiteStore):
+    """
+    Extracted pages of every indexed document keyed by content hash.
+    Duplicate files and re-uploads reuse the text instead of going through OCR again.
+    """
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS pages (doc_hash TEXT PRIMARY KEY, pages TEXT NOT NULL)",)
+
+    def get(self, doc_hash):
+        """Return the [(page, text)] extracted from the document, or None if there is no text for it."""
+        with self.lock:
+            row = self.conn.execute("SELECT pages FROM pages WHERE doc_hash = ?", (doc_hash,)).fetchone()
+        # Empty entries were written by older versions after a failed OCR, they don't count
+        return ([tuple(page) for page in json.loads(row[0])] or None) if row else None
+
+    def put(self, doc_hash, pages):
+        """Store the extracted pages. Empty extractions are not stored, the manifest marks those files instead."""
+        if not pages:
+            return
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (doc_hash, json.dumps(list(pages))))
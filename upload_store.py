@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import threading
+import time
+from sqlite_store import SQLiteStore
+
+class UploadStore(SQLiteStore):
+    """
+    Extracted text of uploads waiting to be attached to their session's next message, and the
+    status of upload jobs. Kept in SQLite so every worker process sees the same entries.
+    Entries expire ttl_seconds after their last use, and beyond max_bytes of stored text the
+    least recently used uploads are evicted. A background thread sweeps out expired entries.
+    """
+    SCHEMA = (
+        # One pending upload per chat session, a newer upload replaces it
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        " session_id TEXT PRIMARY KEY, owner INTEGER, filename TEXT NOT NULL, text TEXT NOT NULL,"
+        " size INTEGER NOT NULL, accessed REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)",
+    )
+
+    def __init__(self, path, max_bytes, ttl_seconds, sweep_interval=60):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        threading.Thread(target=self._sweep, args=(sweep_interval,), name="upload-store-sweep", daemon=True).start()
+
+    def put(self, session_id, owner, filename, text):
+        """Hold text for the session's next message, evicting old uploads to stay within max_bytes."""
+        size = len(text.encode("utf-8"))
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (str(session_id), owner, filename, text, size, time.time()),
+            )
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+            for old_session_id, old_size in self.conn.execute(
+                "SELECT session_id, size FROM uploads WHERE session_id != ? ORDER BY accessed", (str(session_id),)
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM uploads WHERE session_id = ?", (old_session_id,))
+                total -= old_size
+
+    def take(self, session_id, owner):
+        """Remove and return (filename, text) of the session's pending upload, or None."""
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT filename, text FROM uploads WHERE session_id = ? AND owner = ? AND accessed > ?",
+                (str(session_id), owner, time.time() - self.ttl_seconds),
+            ).fetchone()
+            self.conn.execute("DELETE FROM uploads WHERE session_id = ?", (str(session_id),))
+        return row
+
+    def put_job(self, job):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?)", (job["id"], json.dumps(job), job["updated"])
+            )
+
+    def get_job(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def expire(self):
+        """Drop uploads and job records older than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM uploads WHERE accessed < ?", (cutoff,))
+            self.conn.execute("DELETE FROM jobs WHERE updated < ?", (cutoff,))
+
+    def _sweep(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.expire()
+            except sqlite3.Error as e:
+                print(f"Upload store cleanup failed: {e}")
@@ -0,0 +1,110 @@
+"""
+Watches the documents directory so files added, edited or deleted by hand are indexed
+while the app runs, see rag_utils.start_document_watcher.
+
+Uses filesystem events from watchdog when it is installed (pip install watchdog) and
+otherwise compares the size and modification time of every file every few seconds.
+"""
+import os
+import threading
+import time
+
+# Events that can change what a file contains; watchdog also reports files being opened or read
+CHANGE_EVENTS = {"created", "modified", "deleted", "moved"}
+
+def snapshot(directory):
+    """{path: (size, mtime)} of every file below directory."""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted while walking
+                continue
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+class DocumentWatcher:
+    """
+    Calls on_change() once the directory has been quiet for debounce seconds after a change,
+    so a batch of copied files (or one large file being written) is synced in one go.
+    on_change runs on the watcher's own thread; changes made meanwhile trigger another call.
+    """
+
+    def __init__(self, directory, on_change, debounce=2.0, poll_interval=5.0):
+        self.directory = directory
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.last_change = None
+        self.observer = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            self._start_observer()
+            print(f"Watching {self.directory} for changes")
+        except ImportError:
+            threading.Thread(target=self._poll, name="document-poller", daemon=True).start()
+            print(f"Watching {self.directory} for changes every {self.poll_interval}s (install watchdog for instant updates)")
+        threading.Thread(target=self._run, name="document-watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+        if self.observer is not None:
+            self.observer.stop()
+
+    def notify(self):
+        """Record a change, the sync runs once no further change arrived for debounce seconds."""
+        with self.lock:
+            self.last_change = time.monotonic()
+        self.changed.set()
+
+    def _start_observer(self):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in CHANGE_EVENTS:
+                    watcher.notify()
+
+        self.observer = Observer()
+        self.observer.daemon = True
+        self.observer.schedule(Handler(), self.directory, recursive=True)
+        self.observer.start()
+
+    def _poll(self):
+        previous = snapshot(self.directory)
+        while not self.stopped.wait(self.poll_interval):
+            current = snapshot(self.directory)
+            if current != previous:
+                self.notify()
+            previous = current
+
+    def _run(self):
+        while True:
+            self.changed.wait()
+            if self.stopped.is_set():
+                return
+            # Wait until the directory has been quiet for the debounce time
+            while True:
+                with self.lock:
+                    remaining = self.last_change + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        self.changed.clear()
+                        break
+                time.sleep(remaining)
+            try:
+                self.on_change()
+            except Exception as e:
+                print(f"Syncing changed documents failed: {e}")